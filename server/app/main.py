@@ -1,20 +1,44 @@
+import time
+_import_started = time.perf_counter()
+
 import os
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from dotenv import load_dotenv
-from .routes import mcp
 
-# Load environment variables
+# Load environment variables before importing modules that read them
 load_dotenv()
 
+from .routes import mcp
+from .services import warmup, tracing
+
+warmup.record_phase("import", _import_started)
+logger = tracing.get_logger(__name__)
+
 # Ensure GOOGLE_API_KEY is set
 if "GOOGLE_API_KEY" not in os.environ:
     raise ValueError("GOOGLE_API_KEY not found in environment variables. Please set it in your .env file.")
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Warm resources in the background so /health answers immediately while /ready waits
+    prewarm_task = asyncio.create_task(warmup.prewarm()) if warmup.prewarm_enabled() else None
+    warmup.mark_startup_complete()
+    logger.info("Startup phases (ms): %s", warmup.startup_phases)
+    yield
+    if prewarm_task is not None and not prewarm_task.done():
+        prewarm_task.cancel()
+    await warmup.shutdown()
+    tracing.stop_logging()
+
 app = FastAPI(
     title="MCP Agent Server",
     description="A server that provides MCP agent capabilities through a REST API",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 allowed_origins = os.getenv("ALLOWED_ORIGINS", "*").split(",")
@@ -25,6 +49,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Trace-Id"],
 )
 
 # Include routers
@@ -32,4 +57,10 @@ app.include_router(mcp.router, prefix="/api/v1")
 
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy"} 
\ No newline at end of file
+    return {"status": "healthy"}
+
+@app.get("/ready")
+async def readiness_check():
+    """Readiness probe: 200 once the LLM client, MCP sessions and ad-server connection are warm."""
+    report = warmup.readiness_report()
+    return JSONResponse(status_code=200 if warmup.is_ready() else 503, content=report)
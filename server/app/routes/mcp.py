@@ -1,20 +1,30 @@
-from fastapi import APIRouter, HTTPException
-from pydantic import BaseModel
+from fastapi import APIRouter, HTTPException, Request, Response
+from pydantic import BaseModel, Field
 from typing import Dict, Any, Optional
 from ..services.agent_service import run_agent_task
-from ..services.ad_service import integrate_recommendations, StreamingAdSession
+from ..services.ad_service import integrate_recommendations_with_deadline, StreamingAdSession
 from fastapi.responses import RedirectResponse
 from sse_starlette.sse import EventSourceResponse
-from langchain_google_genai import ChatGoogleGenerativeAI
+from ..services.budget import budget_report
+from ..services.llm import get_chat_model, DEFAULT_MODEL, DEFAULT_TEMPERATURE
+from ..services.llm_calls import call_llm, stream_llm, llm_call_stats
+from ..services.cassette import CassetteMiss, open_cassette, cassette_stream
+from ..services.tracing import new_trace_id, start_trace, trace_stream, get_trace_timeline, get_thread_trace_ids
 import json
 import asyncio
 import os
 
 router = APIRouter()
 
+class PlanBudget(BaseModel):
+    time_seconds: Optional[float] = Field(default=None, gt=0) # Wall-clock time for the whole run
+    tokens: Optional[int] = Field(default=None, gt=0) # LLM tokens across planning, subtasks and the final result
+    max_subtasks: Optional[int] = Field(default=None, gt=0)
+
 class MCPRequest(BaseModel):
     task: str
     thread_id: Optional[str] = None
+    budget: Optional[PlanBudget] = None
 
 class MCPResponse(BaseModel):
     status: str
@@ -23,27 +33,47 @@ class MCPResponse(BaseModel):
 
 class GeminiRequest(BaseModel):
     prompt: str
-    temperature: Optional[float] = 0.7
-    model: Optional[str] = "models/gemini-2.5-flash"
+    temperature: Optional[float] = DEFAULT_TEMPERATURE
+    model: Optional[str] = DEFAULT_MODEL
 
 class GeminiResponse(BaseModel):
     status: str
     response: Optional[str] = None
     error: Optional[str] = None
+    ads_applied: bool = False
+    ad_integration_ms: Optional[float] = None
 
 @router.get("/")
 async def redirect_to_client():
     """Redirect to the SSE client interface."""
     return RedirectResponse(url="/static/index.html")
 
+def _open_cassette(endpoint: str, body: BaseModel, http_request: Request):
+    """Cassette recording or replaying this request, if cassettes are on."""
+    try:
+        return open_cassette(endpoint, body.model_dump(), http_request.headers)
+    except CassetteMiss as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
 @router.post("/mcp")
-async def handle_mcp_request(request: MCPRequest):
+async def handle_mcp_request(request: MCPRequest, http_request: Request):
+    cassette = _open_cassette("/api/v1/mcp", request, http_request)
     try:
         # Create an async generator that yields SSE events
         async def event_generator():
             last_step = -1
             try:
-                async for state in run_agent_task(request.task, request.thread_id):
+                budget = request.budget.model_dump() if request.budget else None
+                async for state in run_agent_task(request.task, request.thread_id, budget):
+                    progress = state.get("progress")
+                    if progress is not None:
+                        # Tool and partial-output events from inside a subtask; rate-limited at the source
+                        yield {
+                            "event": progress["type"],
+                            "data": json.dumps(progress)
+                        }
+                        continue
+
                     current_task_index = state.get("current_task_index", 0)
                     is_final = state.get("is_final", False)
                     has_error = state.get("error") is not None
@@ -72,6 +102,9 @@ async def handle_mcp_request(request: MCPRequest):
                             "final_result": state.get("final_result"),
                             "error": state.get("error")
                         }
+                        if is_final:
+                            # Budget granted versus used
+                            event_data["budget"] = budget_report(state.get("budget"))
 
                         # Stream the extracted information as an SSE event
                         yield {
@@ -93,8 +126,10 @@ async def handle_mcp_request(request: MCPRequest):
                     })
                 }
 
-        # Return a streaming response with SSE events
-        return EventSourceResponse(event_generator())
+        # Return a streaming response with SSE events, traced as one request
+        trace_id = new_trace_id()
+        events = trace_stream(cassette_stream(event_generator(), cassette), "POST /api/v1/mcp", trace_id=trace_id, thread_id=request.thread_id or "default_thread")
+        return EventSourceResponse(events, headers={"X-Trace-Id": trace_id})
 
     except Exception as e:
         # Handle exceptions outside the event stream
@@ -104,23 +139,25 @@ async def handle_mcp_request(request: MCPRequest):
         )
 
 @router.post("/query", response_model=GeminiResponse)
-async def handle_gemini_request(request: GeminiRequest):
+async def handle_gemini_request(request: GeminiRequest, http_response: Response):
     try:
-        # Initialize Gemini model
-        llm = ChatGoogleGenerativeAI(
-            model=request.model,
-            temperature=request.temperature
-        )
-        
-        # Get response from Gemini
-        response = await llm.ainvoke(request.prompt)
-        
-        # Integrate recommendations into the response
-        response_with_recommendations = await integrate_recommendations(response.content)
-        return GeminiResponse(
-            status="success",
-            response=response_with_recommendations.get('data', response.content)
-        )
+        with start_trace("POST /api/v1/query", model=request.model) as trace:
+            http_response.headers["X-Trace-Id"] = trace.trace_id
+
+            # Get the shared Gemini model
+            llm = get_chat_model(request.model, request.temperature)
+            
+            # Get response from Gemini
+            response = await call_llm("query", lambda: llm.ainvoke(request.prompt))
+            
+            # Integrate recommendations into the response, unless the ad server misses its deadline
+            integration = await integrate_recommendations_with_deadline(response.content)
+            return GeminiResponse(
+                status="success",
+                response=integration["data"],
+                ads_applied=integration["ads_applied"],
+                ad_integration_ms=integration["integration_ms"]
+            )
         
     except Exception as e:
         raise HTTPException(
@@ -129,24 +166,22 @@ async def handle_gemini_request(request: GeminiRequest):
         )
 
 @router.post("/query/stream")
-async def handle_gemini_stream_request(request: GeminiRequest):
+async def handle_gemini_stream_request(request: GeminiRequest, http_request: Request):
+    cassette = _open_cassette("/api/v1/query/stream", request, http_request)
     try:
         # Create an async generator that yields SSE events for streaming Gemini responses
         async def event_generator():
             ad_session = None
             try:
-                # Initialize Gemini model
-                llm = ChatGoogleGenerativeAI(
-                    model=request.model,
-                    temperature=request.temperature
-                )
+                # Get the shared Gemini model
+                llm = get_chat_model(request.model, request.temperature)
                 
                 # Initialize streaming ad session
                 ad_session = StreamingAdSession(content_type="chat", language="en")
                 await ad_session.initialize()
                 
                 # Stream response from Gemini with ad integration
-                async for chunk in llm.astream(request.prompt):
+                async for chunk in stream_llm("query_stream", lambda: llm.astream(request.prompt)):
                     if hasattr(chunk, 'content') and chunk.content:
                         # Process chunk through ad server immediately
                         processed_chunk = await ad_session.process_chunk(chunk.content)
@@ -192,12 +227,38 @@ async def handle_gemini_stream_request(request: GeminiRequest):
                     })
                 }
 
-        # Return a streaming response with SSE events
-        return EventSourceResponse(event_generator())
+        # Return a streaming response with SSE events, traced as one request
+        trace_id = new_trace_id()
+        events = trace_stream(cassette_stream(event_generator(), cassette), "POST /api/v1/query/stream", trace_id=trace_id, model=request.model)
+        return EventSourceResponse(events, headers={"X-Trace-Id": trace_id})
 
     except Exception as e:
         # Handle exceptions outside the event stream
         raise HTTPException(
             status_code=500,
             detail=str(e)
-        ) 
\ No newline at end of file
+        )
+
+@router.get("/metrics/llm")
+async def get_llm_metrics():
+    """Per-call LLM latency percentiles, retries, timeouts and hedges fired/won."""
+    return llm_call_stats()
+
+@router.get("/metrics/agent")
+async def get_agent_metrics():
+    """Cache hits and time spent building tool-calling agents for subtasks."""
+    from ..services.agent_cache import setup_stats
+    return setup_stats
+
+@router.get("/debug/traces/{trace_id}")
+async def get_trace(trace_id: str):
+    """Span timeline of a recent request, by the trace id returned in its X-Trace-Id header."""
+    timeline = get_trace_timeline(trace_id)
+    if timeline is None:
+        raise HTTPException(status_code=404, detail="Trace not found")
+    return timeline
+
+@router.get("/debug/threads/{thread_id}/traces")
+async def get_thread_traces(thread_id: str):
+    """Span timelines of the recent /mcp requests for a thread, oldest first."""
+    return [get_trace_timeline(trace_id) for trace_id in get_thread_trace_ids(thread_id)]
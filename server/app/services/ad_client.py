@@ -1,94 +1,131 @@
 import os
 import aiohttp
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, Tuple
 import asyncio
+from .tracing import get_logger, traced
+from .cassette import recorded
+
+logger = get_logger(__name__)
 
 class AdServerClient:
     def __init__(self):
         self.base_url = os.getenv('ADSERVER_URL', '')
         self.api_key = os.getenv('MADGIC_API_KEY', '')
         self.timeout = aiohttp.ClientTimeout(total=5.0)  # 5 second timeout
-        
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    def get_session(self) -> aiohttp.ClientSession:
+        """Return the shared HTTP session, creating it on first use so connections are kept alive"""
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(timeout=self.timeout)
+        return self._session
+
+    async def warmup(self) -> bool:
+        """Open a connection to the ad server ahead of the first request"""
+        if not self.base_url or not self.api_key:
+            return False
+
+        session = self.get_session()
+        async with session.head(self.base_url, headers={"x-api-key": self.api_key}) as response:
+            # Any HTTP response means the connection (DNS, TCP and TLS) is established
+            return response.status < 500
+
+    async def close(self):
+        """Close the shared HTTP session"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def _post(self, name: str, path: str, payload: Dict[str, Any], read_body: bool = True) -> Tuple[int, Any]:
+        """POST JSON to the ad server; returns the status and, for a 200 response, the JSON body"""
+        async def send():
+            session = self.get_session()
+            async with session.post(
+                f"{self.base_url}{path}",
+                json=payload,
+                headers={
+                    "x-api-key": self.api_key,
+                    "Content-Type": "application/json"
+                }
+            ) as response:
+                data = await response.json() if read_body and response.status == 200 else None
+                return [response.status, data]
+
+        # Recorded and replayed when cassettes are on
+        status, data = await recorded("ad", name, {"path": path, "payload": payload}, send)
+        return status, data
+
+    @traced("ad.initialize_stream", "ad")
     async def initialize_stream(self, content_type: str = "chat", language: str = "en") -> Optional[str]:
         """Initialize a new ad stream session"""
         if not self.base_url or not self.api_key:
             return None
             
         try:
-            async with aiohttp.ClientSession(timeout=self.timeout) as session:
-                async with session.post(
-                    f"{self.base_url}/api/v1/streams",
-                    json={
-                        "content_type": content_type,
-                        "language": language,
-                        "settings": {
-                            "ad_frequency": "moderate"
-                        }
-                    },
-                    headers={
-                        "x-api-key": self.api_key,
-                        "Content-Type": "application/json"
+            status, data = await self._post(
+                "initialize_stream",
+                "/api/v1/streams",
+                {
+                    "content_type": content_type,
+                    "language": language,
+                    "settings": {
+                        "ad_frequency": "moderate"
                     }
-                ) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        return data.get("stream_id")
-                    else:
-                        print(f"Failed to initialize ad stream: {response.status}")
-                        return None
+                }
+            )
+            if status == 200:
+                return data.get("stream_id")
+            else:
+                logger.warning("Failed to initialize ad stream: %s", status)
+                return None
         except Exception as e:
-            print(f"Error initializing ad stream: {str(e)}")
+            logger.warning("Error initializing ad stream: %s", e)
             return None
     
+    @traced("ad.process_chunk", "ad")
     async def process_chunk(self, stream_id: str, content: str, sequence: int, total_length: int) -> Dict[str, Any]:
         """Process a content chunk through the ad server"""
         if not self.base_url or not self.api_key or not stream_id:
             return {"processed_content": content, "ads_added": []}
             
         try:
-            async with aiohttp.ClientSession(timeout=self.timeout) as session:
-                async with session.post(
-                    f"{self.base_url}/api/v1/streams/{stream_id}/chunks",
-                    json={
-                        "content": content,
-                        "sequence": sequence,
-                        "total_length_so_far": total_length
-                    },
-                    headers={
-                        "x-api-key": self.api_key,
-                        "Content-Type": "application/json"
-                    }
-                ) as response:
-                    if response.status == 200:
-                        return await response.json()
-                    else:
-                        print(f"Failed to process chunk: {response.status}")
-                        return {"processed_content": content, "ads_added": []}
+            status, data = await self._post(
+                "process_chunk",
+                f"/api/v1/streams/{stream_id}/chunks",
+                {
+                    "content": content,
+                    "sequence": sequence,
+                    "total_length_so_far": total_length
+                }
+            )
+            if status == 200:
+                return data
+            else:
+                logger.warning("Failed to process chunk: %s", status)
+                return {"processed_content": content, "ads_added": []}
         except Exception as e:
-            print(f"Error processing chunk: {str(e)}")
+            logger.warning("Error processing chunk: %s", e)
             return {"processed_content": content, "ads_added": []}
     
+    @traced("ad.finalize_stream", "ad")
     async def finalize_stream(self, stream_id: str, total_chunks: int, final_word_count: int) -> bool:
         """Finalize the ad stream session"""
         if not self.base_url or not self.api_key or not stream_id:
             return True
             
         try:
-            async with aiohttp.ClientSession(timeout=self.timeout) as session:
-                async with session.post(
-                    f"{self.base_url}/api/v1/streams/{stream_id}/finalize",
-                    json={
-                        "total_chunks": total_chunks,
-                        "final_word_count": final_word_count
-                    },
-                    headers={
-                        "x-api-key": self.api_key,
-                        "Content-Type": "application/json"
-                    }
-                ) as response:
-                    return response.status == 200
+            status, _ = await self._post(
+                "finalize_stream",
+                f"/api/v1/streams/{stream_id}/finalize",
+                {
+                    "total_chunks": total_chunks,
+                    "final_word_count": final_word_count
+                },
+                read_body=False
+            )
+            return status == 200
         except Exception as e:
-            print(f"Error finalizing stream: {str(e)}")
+            logger.warning("Error finalizing stream: %s", e)
             return False
 
 # Global client instance
@@ -1,31 +1,87 @@
 import os
-import aiohttp
-from typing import Optional
+import time
+import asyncio
+import hashlib
+from typing import Optional, Dict, Any
+from cachetools import TTLCache
 from .ad_client import ad_client
+from .tracing import get_logger, traced
+
+logger = get_logger(__name__)
 
 ADSERVER_URL = os.getenv('ADSERVER_URL')
 MADGIC_API_KEY = os.getenv('MADGIC_API_KEY', '')
 
-# non-streaming responses
-async def integrate_recommendations(text: str) -> dict:
+# How long /query waits for the ad server before answering without ads
+AD_INTEGRATION_DEADLINE_MS = float(os.getenv('AD_INTEGRATION_DEADLINE_MS', '800'))
+AD_CACHE_TTL_SECONDS = float(os.getenv('AD_CACHE_TTL_SECONDS', '600'))
+
+# Integrated text by hash of the original text
+_integration_cache: TTLCache = TTLCache(maxsize=1024, ttl=AD_CACHE_TTL_SECONDS)
+# Integrate calls still running, by hash; late calls finish in the background and fill the cache
+_in_flight: Dict[str, asyncio.Task] = {}
+
+@traced("ad.integrate", "ad")
+async def _post_integrate(text: str) -> str:
+    """Send text to the ad server and return the text with ads integrated. Raises on failure."""
+    session = ad_client.get_session()
+    async with session.post(
+        f"{ADSERVER_URL}/api/ads/integrate",
+        json={"text": text},
+        headers={
+            "x-api-key": MADGIC_API_KEY,
+            "Content-Type": "application/json",
+        }
+    ) as response:
+        if response.status != 200:
+            raise RuntimeError(f"Ad server responded with status {response.status}")
+        data = await response.json()
+        return data.get("data", text)
+
+async def _integrate_and_cache(key: str, text: str) -> str:
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                f"{ADSERVER_URL}/api/ads/integrate",
-                json={"text": text},
-                headers={
-                    "x-api-key": MADGIC_API_KEY,
-                    "Content-Type": "application/json",
-                }
-            ) as response:
-                if response.status == 200:
-                    return await response.json()
-                else:
-                    print(f"Ad server responded with status {response.status}")
-                    return {"data": text}
+        integrated = await _post_integrate(text)
+        _integration_cache[key] = integrated
+        return integrated
     except Exception as e:
-        print(f"Error integrating recommendations: {str(e)}")
-        return {"data": text}
+        logger.warning("Error integrating recommendations: %s", e)
+        return text
+    finally:
+        _in_flight.pop(key, None)
+
+# non-streaming responses
+async def integrate_recommendations_with_deadline(text: str, deadline_ms: Optional[float] = None) -> Dict[str, Any]:
+    """
+    Integrates ads into a complete response without letting the ad server delay it.
+
+    Results are cached by content hash. If the ad server has not answered within the
+    deadline, the unmodified text is returned and the call keeps running in the
+    background so that the next identical answer is served from the cache.
+
+    Returns a dict with "data" (the text to send), "ads_applied", "cached" and
+    "integration_ms".
+    """
+    started = time.perf_counter()
+    deadline_ms = AD_INTEGRATION_DEADLINE_MS if deadline_ms is None else deadline_ms
+    result = {"data": text, "ads_applied": False, "cached": False}
+
+    if ADSERVER_URL and isinstance(text, str) and text:
+        key = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        cached = _integration_cache.get(key)
+        if cached is not None:
+            result.update(data=cached, cached=True)
+        else:
+            task = _in_flight.get(key)
+            if task is None:
+                task = _in_flight[key] = asyncio.create_task(_integrate_and_cache(key, text))
+            try:
+                result["data"] = await asyncio.wait_for(asyncio.shield(task), deadline_ms / 1000)
+            except TimeoutError:
+                logger.info("Ad integration exceeded %.0f ms; answering without ads", deadline_ms)
+
+    result["ads_applied"] = result["data"] != text
+    result["integration_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    return result
 
 # streaming-based ad integration
 class StreamingAdSession:
@@ -0,0 +1,82 @@
+import json
+import time
+import hashlib
+from collections import OrderedDict
+from typing import Any, Dict, List, Tuple
+from langchain_core.language_models import BaseChatModel
+from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+from langchain_core.tools import BaseTool
+from langchain.agents import create_tool_calling_agent, AgentExecutor
+
+# The prompt does not depend on the subtask, so it is built once
+TASK_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", "You are an AI assistant tasked with executing the following subtask by using available tools: {task}. \
+     you can use the tools to answer the user's request. \
+     available tools: {tool_names} \
+     available data: {data}"),
+    ("human", "{input}"),
+    MessagesPlaceholder(variable_name="agent_scratchpad"),
+])
+
+MAX_CACHED = 8
+
+# Bound agents (prompt | llm with tool schemas), keyed by a fingerprint of the model and tool schemas
+_agents: "OrderedDict[str, Any]" = OrderedDict()
+# Executors, keyed by the identity of the model and tool objects they run
+_executors: "OrderedDict[Tuple[int, ...], Tuple[AgentExecutor, str]]" = OrderedDict()
+
+setup_stats: Dict[str, Any] = {
+    "executor_hits": 0,
+    "agent_hits": 0,
+    "misses": 0,
+    "last_setup_ms": None,
+    "total_setup_ms": 0.0,
+}
+
+def _remember(cache: OrderedDict, key, value):
+    cache[key] = value
+    cache.move_to_end(key)
+    while len(cache) > MAX_CACHED:
+        cache.popitem(last=False)
+
+def tool_set_fingerprint(llm: BaseChatModel, tools: List[BaseTool]) -> str:
+    """Hash of the model configuration and the name, description and arguments of every tool."""
+    payload = {
+        "model": [llm._llm_type, llm._identifying_params],
+        "tools": [[tool.name, tool.description, tool.args] for tool in tools],
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+def get_agent_executor(llm: BaseChatModel, tools: List[BaseTool]) -> Tuple[AgentExecutor, str]:
+    """
+    Returns a tool-calling AgentExecutor for the model and tools, plus the comma-separated
+    tool names for the prompt.
+
+    The executor is reused while the same model and tool objects are passed in. When the
+    tool objects change (e.g. after the MCP client reconnects) but their schemas don't,
+    only a new executor is built around the already bound agent.
+    """
+    started = time.perf_counter()
+    executor_key = (id(llm), *(id(tool) for tool in tools))
+    cached = _executors.get(executor_key)
+    if cached is not None:
+        _executors.move_to_end(executor_key)
+        setup_stats["executor_hits"] += 1
+    else:
+        fingerprint = tool_set_fingerprint(llm, tools)
+        agent = _agents.get(fingerprint)
+        if agent is not None:
+            setup_stats["agent_hits"] += 1
+        else:
+            setup_stats["misses"] += 1
+            agent = create_tool_calling_agent(llm, tools, TASK_PROMPT)
+            _remember(_agents, fingerprint, agent)
+
+        executor = AgentExecutor(agent=agent, tools=tools, return_intermediate_steps=True, verbose=False)
+        cached = (executor, ", ".join(tool.name for tool in tools))
+        _remember(_executors, executor_key, cached)
+
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    setup_stats["last_setup_ms"] = round(elapsed_ms, 3)
+    setup_stats["total_setup_ms"] += elapsed_ms
+    return cached
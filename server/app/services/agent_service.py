@@ -1,36 +1,60 @@
 from typing import Dict, Any, Optional, AsyncGenerator
-from langchain_google_genai import ChatGoogleGenerativeAI
-from .graph import build_graph
-from .nodes import set_llm_and_tools
-from .tools import init_mcp_client, cleanup_mcp_client, get_tools
+from .llm import get_chat_model
+from .budget import new_budget
+from . import warmup
+from .agent_state import apply_update
 
-async def run_agent_task(task: str, thread_id: Optional[str] = None) -> AsyncGenerator[Dict[str, Any], None]:
+AGENT_MODEL = "models/gemini-2.5-flash"
+AGENT_TEMPERATURE = 0.3
+
+# Compiled LangGraph app, built once and shared by all requests
+_agent_graph = None
+
+def get_agent_graph():
+    """
+    Returns the compiled agent graph, building it on first use.
+    langgraph and the node modules are imported here rather than at module level
+    so that importing the API routes stays cheap.
+    """
+    global _agent_graph
+    if _agent_graph is None:
+        from .graph import build_graph
+        from .nodes import set_llm_and_tools
+
+        llm = get_chat_model(AGENT_MODEL, AGENT_TEMPERATURE)
+        set_llm_and_tools(llm)
+        _agent_graph = build_graph(llm)
+        warmup.mark_warm("graph")
+    return _agent_graph
+
+async def run_agent_task(task: str, thread_id: Optional[str] = None, budget: Optional[Dict[str, Any]] = None) -> AsyncGenerator[Dict[str, Any], None]:
     """
-    Runs the LangGraph agent for a given task and yields each state update.
+    Runs the LangGraph agent for a given task and yields the state after each step.
+    Progress events emitted during a subtask are yielded as {"progress": event}.
+
+    The graph streams only what each node changed; the full state is kept here as
+    a snapshot that the updates are applied to.
     
     Args:
         task: The task to execute
         thread_id: Optional thread ID for conversation tracking
+        budget: Optional limits with "time_seconds", "tokens" and "max_subtasks" keys
         
     Yields:
         Dict containing each step's state information
     """
     try:
-        # Initialize MCP client and get tools
-        await init_mcp_client()
+        from .tools import get_tools
+
+        # Get tools; the MCP sessions stay open across requests
         mcp_tools = await get_tools()
         
-        # Initialize LLM
-        llm = ChatGoogleGenerativeAI(model="models/gemini-2.5-flash", temperature=0.3)
-        
-        # Set the initialized LLM and tools
-        set_llm_and_tools(llm)
-        
-        # Build the LangGraph app
-        app = build_graph(llm)
+        # Get the compiled LangGraph app
+        app = get_agent_graph()
         
-        # Use provided thread_id or generate a new one
-        config = {"configurable": {"thread_id": thread_id or "default_thread"}}
+        # Use provided thread_id or generate a new one; tools reach the nodes through the
+        # run config rather than the state
+        config = {"configurable": {"thread_id": thread_id or "default_thread", "tools": mcp_tools}}
         
         inputs = {
             "task": task,
@@ -38,32 +62,32 @@ async def run_agent_task(task: str, thread_id: Optional[str] = None) -> AsyncGen
             "results": {},
             "plan": None,
             "error": None,
-            "tools": mcp_tools
+            "budget": new_budget(**(budget or {}))
         }
         
-        final_state = None
-        step_count = 0
+        state = dict(inputs)
+        step_count = 1
+        # The initial state is the first step, as with stream_mode="values"
+        final_state = {**state, "step": step_count, "is_final": False}
+        yield final_state
         
-        # Yield each state update as it comes in
-        async for event in app.astream(inputs, config, stream_mode="values"):
+        # Yield the state after each node's update, and progress events from inside the nodes
+        async for mode, event in app.astream(inputs, config, stream_mode=["updates", "custom"]):
+            if mode == "custom":
+                yield {"progress": event}
+                continue
+
+            for update in event.values():
+                apply_update(state, update)
             step_count += 1
-            # Add step information to the state
-            event["step"] = step_count
-            event["is_final"] = False
-            
-            yield event
-            final_state = event
+            # Shallow copy with step information; the results dict itself is not copied
+            final_state = {**state, "step": step_count, "is_final": False}
             
-        if final_state:
-            # Mark the final state
-            final_state["is_final"] = True
             yield final_state
-        else:
-            yield {
-                "error": "No final state captured",
-                "is_final": True,
-                "step": step_count + 1
-            }
+            
+        # Mark the final state
+        final_state["is_final"] = True
+        yield final_state
             
     except Exception as e:
         # Yield any exceptions that occur
@@ -71,7 +95,4 @@ async def run_agent_task(task: str, thread_id: Optional[str] = None) -> AsyncGen
             "error": str(e),
             "is_final": True,
             "step": step_count if 'step_count' in locals() else 1
-        }
-    finally:
-        # Clean up the MCP client resources
-        await cleanup_mcp_client() 
\ No newline at end of file
+        } 
\ No newline at end of file
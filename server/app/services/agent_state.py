@@ -1,11 +1,35 @@
-from typing import TypedDict, List, Dict, Optional
-from langchain_core.tools import BaseTool
+from typing import Annotated, Callable, TypedDict, List, Dict, Optional, Any, get_origin, get_type_hints
+
+def add_results(current: Dict[str, str], update: Dict[str, str]) -> Dict[str, str]:
+    """Reducer for `results`: nodes return only the new entries, which are added to the existing ones."""
+    return {**(current or {}), **(update or {})}
 
 class AgentState(TypedDict):
     task: str # The initial high-level task
     plan: Optional[List[str]] # List of sub-tasks
     current_task_index: int # Index to track the current sub-task
-    results: Dict[str, str] # To store results of each sub-task
+    results: Annotated[Dict[str, str], add_results] # To store results of each sub-task
     final_result: Optional[str] # Final response to the task
     error: Optional[str] # To store any error messages
-    tools: Optional[List[BaseTool]] # List of available tools 
\ No newline at end of file
+    budget: Optional[Dict[str, Any]] # Time and token budget granted and used (see budget.py)
+
+# Tools are not part of the state; they are passed to a run in config["configurable"]["tools"]
+# (see nodes.utils.get_run_tools), so steps don't copy, stream or checkpoint live tool objects.
+
+def _reducers(schema) -> Dict[str, Callable[[Any, Any], Any]]:
+    """Reducers of a state schema's fields, read from their Annotated metadata as LangGraph does."""
+    hints = get_type_hints(schema, include_extras=True)
+    return {
+        key: hint.__metadata__[-1]
+        for key, hint in hints.items()
+        if get_origin(hint) is Annotated and callable(hint.__metadata__[-1])
+    }
+
+_REDUCERS = _reducers(AgentState)
+
+def apply_update(state: Dict[str, Any], update: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """Apply a node's update to a state snapshot in place, using the same reducers as the graph."""
+    for key, value in (update or {}).items():
+        reducer = _REDUCERS.get(key)
+        state[key] = reducer(state.get(key), value) if reducer else value
+    return state
@@ -0,0 +1,139 @@
+import os
+import re
+import time
+from typing import Any, Dict, List, Optional
+
+# Defaults for requests that don't set their own budget
+DEFAULT_TIME_SECONDS = float(os.getenv("PLAN_TIME_BUDGET_SECONDS", "120"))
+DEFAULT_TOKENS = int(os.getenv("PLAN_TOKEN_BUDGET", "200000"))
+DEFAULT_MAX_SUBTASKS = int(os.getenv("PLAN_MAX_SUBTASKS", "6"))
+
+# Time kept back for generating the final result
+FINAL_RESULT_RESERVE_SECONDS = 10.0
+# A subtask that runs is given at least this long, even when the budget is nearly spent
+MIN_SUBTASK_SECONDS = 5.0
+
+# Subtasks with fewer words than this are merged into their neighbour
+TRIVIAL_STEP_WORDS = 5
+
+# Steps that only summarize or present the final answer, which generate_final_result already
+# does, e.g. "Present the final answer" or "Summarize the findings for the user". Anything else
+# is left to the planner prompt, which asks for no such steps.
+LOW_VALUE_STEP = re.compile(
+    r"^(summari[sz]e|present|deliver|report|provide|give)\s+(the\s+)?"
+    r"(final\s+(answer|response|results?|summary)|(answer|results|findings|summary)\s+(to|for)\s+the\s+user)\b",
+    re.IGNORECASE,
+)
+
+# Running averages of what one subtask costs, updated after every subtask
+_SMOOTHING = 0.2
+subtask_cost_estimate: Dict[str, float] = {
+    "seconds": float(os.getenv("PLAN_SECONDS_PER_SUBTASK", "15")),
+    "tokens": float(os.getenv("PLAN_TOKENS_PER_SUBTASK", "8000")),
+}
+
+def new_budget(time_seconds: Optional[float] = None, tokens: Optional[int] = None, max_subtasks: Optional[int] = None) -> Dict[str, Any]:
+    """Create the budget state for one request; unset limits fall back to the defaults."""
+    return {
+        "granted": {
+            "seconds": time_seconds if time_seconds is not None else DEFAULT_TIME_SECONDS,
+            "tokens": tokens if tokens is not None else DEFAULT_TOKENS,
+            "subtasks": max_subtasks if max_subtasks is not None else DEFAULT_MAX_SUBTASKS,
+        },
+        "started_at": time.time(),
+        "tokens": 0,
+        "subtasks": 0,
+        "planned_subtasks": None,
+    }
+
+def elapsed_seconds(budget: Dict[str, Any]) -> float:
+    return time.time() - budget["started_at"]
+
+def subtask_deadline(budget: Optional[Dict[str, Any]], limit: float) -> float:
+    """Deadline for one subtask: `limit`, cut to the time left before the final result's reserve."""
+    if not budget:
+        return limit
+    remaining_seconds = budget["granted"]["seconds"] - elapsed_seconds(budget) - FINAL_RESULT_RESERVE_SECONDS
+    return min(limit, max(remaining_seconds, MIN_SUBTASK_SECONDS))
+
+def max_plan_steps(budget: Optional[Dict[str, Any]]) -> int:
+    """How many subtasks fit in the budget, based on the running per-subtask estimates."""
+    if not budget:
+        return DEFAULT_MAX_SUBTASKS
+    granted = budget["granted"]
+    remaining_seconds = granted["seconds"] - elapsed_seconds(budget) - FINAL_RESULT_RESERVE_SECONDS
+    remaining_tokens = granted["tokens"] - budget["tokens"]
+    by_time = int(remaining_seconds // max(subtask_cost_estimate["seconds"], 0.001))
+    by_tokens = int(remaining_tokens // max(subtask_cost_estimate["tokens"], 1))
+    return max(1, min(granted["subtasks"], by_time, by_tokens))
+
+def refine_plan(subtasks: List[str], max_steps: int) -> List[str]:
+    """
+    Drops presentation-only steps, merges trivial steps into their neighbour and
+    trims the plan to `max_steps`.
+    """
+    steps = [step for step in subtasks if not LOW_VALUE_STEP.match(step)] or subtasks[:1]
+
+    merged: List[str] = []
+    carry = ""
+    for step in steps:
+        step = f"{carry}; then {step}" if carry else step
+        carry = ""
+        if len(step.split()) < TRIVIAL_STEP_WORDS:
+            carry = step
+        else:
+            merged.append(step)
+    if carry:
+        if merged:
+            merged[-1] = f"{merged[-1]}; then {carry}"
+        else:
+            merged.append(carry)
+
+    return merged[:max_steps]
+
+def add_usage(budget: Optional[Dict[str, Any]], tokens: int = 0, subtasks: int = 0) -> Optional[Dict[str, Any]]:
+    """Return a copy of the budget with the given usage added."""
+    if not budget:
+        return budget
+    return {**budget, "tokens": budget["tokens"] + tokens, "subtasks": budget["subtasks"] + subtasks}
+
+def record_subtask_cost(seconds: float, tokens: int):
+    """Fold the cost of a finished subtask into the running estimates used for planning."""
+    subtask_cost_estimate["seconds"] += _SMOOTHING * (seconds - subtask_cost_estimate["seconds"])
+    if tokens:
+        subtask_cost_estimate["tokens"] += _SMOOTHING * (tokens - subtask_cost_estimate["tokens"])
+
+def is_spent(budget: Optional[Dict[str, Any]]) -> bool:
+    """
+    True once the time or token budget is used up, or when the next subtask is expected
+    to run past the time budget. The first subtask always runs.
+    """
+    if not budget or budget["subtasks"] == 0:
+        return False
+    granted = budget["granted"]
+    expected_end = elapsed_seconds(budget) + subtask_cost_estimate["seconds"] + FINAL_RESULT_RESERVE_SECONDS
+    return (
+        budget["tokens"] >= granted["tokens"]
+        or budget["subtasks"] >= granted["subtasks"]
+        or expected_end > granted["seconds"]
+    )
+
+def usage_tokens(message: Any) -> int:
+    """Total tokens reported on an LLM response, or 0 if the model did not report usage."""
+    usage = getattr(message, "usage_metadata", None) or {}
+    return usage.get("total_tokens", 0)
+
+def budget_report(budget: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """Budget granted versus used, for the final SSE event."""
+    if not budget:
+        return None
+    return {
+        "granted": budget["granted"],
+        "used": {
+            "seconds": round(elapsed_seconds(budget), 2),
+            "tokens": budget["tokens"],
+            "subtasks": budget["subtasks"],
+        },
+        "planned_subtasks": budget["planned_subtasks"],
+        "stopped_early": budget["planned_subtasks"] is not None and budget["subtasks"] < budget["planned_subtasks"],
+    }
@@ -0,0 +1,265 @@
+import os
+import glob
+import json
+import time
+import uuid
+import asyncio
+import hashlib
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Mapping, Optional
+from .tracing import get_logger, annotate
+
+logger = get_logger(__name__)
+
+# off, record or replay
+CASSETTE_MODE = os.getenv("CASSETTE_MODE", "off").lower()
+CASSETTE_DIR = os.getenv("CASSETTE_DIR", "cassettes")
+# Replayed exchanges take their recorded time ("recorded") or return at once ("zero");
+# a request can override this with the X-Cassette-Latency header
+CASSETTE_LATENCY = os.getenv("CASSETTE_LATENCY", "recorded").lower()
+
+class CassetteMiss(LookupError):
+    """Raised in replay mode when a request or exchange was not recorded."""
+
+class ReplayedError(RuntimeError):
+    """An exchange that failed while recording fails the same way on replay."""
+
+def _identity(value: Any) -> Any:
+    return value
+
+def request_key(request: Any) -> str:
+    return hashlib.sha256(json.dumps(request, sort_keys=True, default=str).encode()).hexdigest()
+
+def _slug(endpoint: str) -> str:
+    return endpoint.strip("/").replace("/", "_")
+
+class Cassette:
+    """
+    The external exchanges (LLM, MCP tool, search and ad-server calls) made while
+    serving one request, with their timings.
+
+    In record mode exchanges are appended as they complete and the cassette is written
+    to CASSETTE_DIR when the request ends. In replay mode each exchange is served from
+    the recording: first by an exact match of its request, otherwise by the next unused
+    exchange of the same kind and name, so small differences in prompts do not break a replay.
+    """
+
+    def __init__(self, path: str, mode: str, endpoint: str, request: Any, data: Optional[Dict[str, Any]] = None, latency: str = CASSETTE_LATENCY):
+        data = data or {}
+        self.path = path
+        self.mode = mode
+        self.endpoint = endpoint
+        self.request = request
+        self.latency = latency
+        self.exchanges: List[Dict[str, Any]] = data.get("exchanges", [])
+        self.tool_specs: List[Dict[str, Any]] = data.get("tools", [])
+        self.recorded_ms: Optional[float] = data.get("duration_ms")
+        self.replay_tools: Optional[List[Any]] = None  # Stand-in tools built from tool_specs
+        self.stats = {"served": 0, "reused": 0, "unmatched": 0, "waited_ms": 0.0}
+        self._used: set = set()
+        self._started = time.perf_counter()
+        self._started_at = time.time()
+
+    @property
+    def recording(self) -> bool:
+        return self.mode == "record"
+
+    @property
+    def replaying(self) -> bool:
+        return self.mode == "replay"
+
+    def _offset_ms(self) -> float:
+        return round((time.perf_counter() - self._started) * 1000, 2)
+
+    def note_tools(self, specs: List[Dict[str, Any]]):
+        """Store the tool schemas offered to the agent, so replays need no MCP server."""
+        if self.recording and not self.tool_specs:
+            self.tool_specs = specs
+
+    def _take(self, kind: str, name: str, key: str) -> Dict[str, Any]:
+        candidates = [i for i, e in enumerate(self.exchanges) if e["kind"] == kind and e["name"] == name]
+        same_request = [i for i in candidates if self.exchanges[i]["key"] == key]
+        index = next((i for i in same_request if i not in self._used), None)
+        if index is None and same_request:
+            # Asked again with the same request, e.g. a hedged or retried LLM call
+            self.stats["reused"] += 1
+            index = same_request[-1]
+        if index is None:
+            index = next((i for i in candidates if i not in self._used), None)
+            if index is None:
+                raise CassetteMiss(f"No recorded {kind} exchange '{name}' left in {self.path}")
+            self.stats["unmatched"] += 1
+        self._used.add(index)
+        self.stats["served"] += 1
+        return self.exchanges[index]
+
+    async def _wait(self, ms: float):
+        if self.latency == "recorded" and ms > 0:
+            self.stats["waited_ms"] += ms
+            await asyncio.sleep(ms / 1000)
+
+    async def exchange(
+        self,
+        kind: str,
+        name: str,
+        request: Any,
+        call: Callable[[], Awaitable[Any]],
+        encode: Callable[[Any], Any] = _identity,
+        decode: Callable[[Any], Any] = _identity,
+    ) -> Any:
+        """Record the result of `call()`, or serve it from the recording."""
+        key = request_key(request)
+        if self.replaying:
+            entry = self._take(kind, name, key)
+            await self._wait(entry["duration_ms"])
+            if "error" in entry:
+                raise ReplayedError(entry["error"])
+            return decode(entry["response"])
+
+        entry = {"kind": kind, "name": name, "key": key, "offset_ms": self._offset_ms()}
+        started = time.perf_counter()
+        try:
+            result = await call()
+            entry["response"] = encode(result)
+            return result
+        except Exception as e:
+            entry["error"] = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            # Calls cancelled before completing (e.g. the losing side of a hedge) are not recorded
+            if "response" in entry or "error" in entry:
+                entry["duration_ms"] = round((time.perf_counter() - started) * 1000, 2)
+                self.exchanges.append(entry)
+
+    async def stream(
+        self,
+        kind: str,
+        name: str,
+        request: Any,
+        call: Callable[[], AsyncIterator[Any]],
+        encode: Callable[[Any], Any] = _identity,
+        decode: Callable[[Any], Any] = _identity,
+    ) -> AsyncIterator[Any]:
+        """Like `exchange`, for a stream; every chunk is recorded with its offset from the start."""
+        key = request_key(request)
+        if self.replaying:
+            entry = self._take(kind, name, key)
+            previous_ms = 0.0
+            for chunk in entry["chunks"]:
+                await self._wait(chunk["offset_ms"] - previous_ms)
+                previous_ms = chunk["offset_ms"]
+                yield decode(chunk["data"])
+            if "error" in entry:
+                raise ReplayedError(entry["error"])
+            return
+
+        entry = {"kind": kind, "name": name, "key": key, "offset_ms": self._offset_ms(), "chunks": []}
+        started = time.perf_counter()
+        try:
+            async for item in call():
+                entry["chunks"].append({"offset_ms": round((time.perf_counter() - started) * 1000, 2), "data": encode(item)})
+                yield item
+        except Exception as e:
+            entry["error"] = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            # Streams closed early are kept with the chunks received so far
+            entry["duration_ms"] = round((time.perf_counter() - started) * 1000, 2)
+            self.exchanges.append(entry)
+
+    def _write(self, data: Dict[str, Any]):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(self.path, "w", encoding="utf-8") as f:
+            json.dump(data, f, default=str)
+
+    async def finish(self):
+        """Write the recording, or log how the replay compares to it."""
+        duration_ms = self._offset_ms()
+        if self.recording:
+            data = {
+                "version": 1,
+                "endpoint": self.endpoint,
+                "request": self.request,
+                "started_at": self._started_at,
+                "recorded_at": time.time(),
+                "duration_ms": duration_ms,
+                "tools": self.tool_specs,
+                "exchanges": sorted(self.exchanges, key=lambda e: e["offset_ms"]),
+            }
+            await asyncio.to_thread(self._write, data)
+            logger.info("Recorded %d exchanges in %.0f ms to %s", len(self.exchanges), duration_ms, self.path)
+            return
+
+        # With zero latency all of the replay time is our own; with recorded latency
+        # the time spent waiting out recorded exchanges is subtracted
+        overhead_ms = max(duration_ms - self.stats["waited_ms"], 0.0)
+        annotate(cassette=os.path.basename(self.path), replay_overhead_ms=round(overhead_ms, 2))
+        logger.info(
+            "Replayed %s in %.0f ms (recorded %.0f ms, own overhead about %.0f ms); %d exchanges served, %d reused, %d unmatched",
+            os.path.basename(self.path), duration_ms, self.recorded_ms or 0, overhead_ms,
+            self.stats["served"], self.stats["reused"], self.stats["unmatched"],
+        )
+
+_active: ContextVar[Optional[Cassette]] = ContextVar("active_cassette", default=None)
+
+def active_cassette() -> Optional[Cassette]:
+    return _active.get()
+
+def open_cassette(endpoint: str, request: Any, headers: Mapping[str, str]) -> Optional[Cassette]:
+    """
+    Cassette for a request to `endpoint`, or None when cassettes are off.
+
+    In replay mode the cassette named by the X-Cassette header is used, otherwise the
+    latest one recorded for the same endpoint and request body. Raises CassetteMiss
+    if there is none.
+    """
+    if CASSETTE_MODE not in ("record", "replay"):
+        return None
+    prefix = f"{_slug(endpoint)}-{request_key(request)[:12]}"
+    if CASSETTE_MODE == "record":
+        name = f"{prefix}-{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}.json"
+        return Cassette(os.path.join(CASSETTE_DIR, name), "record", endpoint, request)
+
+    name = headers.get("x-cassette")
+    if name:
+        path = os.path.join(CASSETTE_DIR, os.path.basename(name))
+    else:
+        matches = sorted(glob.glob(os.path.join(CASSETTE_DIR, f"{prefix}-*.json")))
+        path = matches[-1] if matches else ""
+    if not path or not os.path.exists(path):
+        raise CassetteMiss(f"No cassette recorded for this {endpoint} request")
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    latency = headers.get("x-cassette-latency", CASSETTE_LATENCY).lower()
+    return Cassette(path, "replay", endpoint, request, data, latency)
+
+async def cassette_stream(events, cassette: Optional[Cassette]):
+    """Runs an async generator (e.g. an SSE event stream) with the cassette active."""
+    if cassette is None:
+        async for event in events:
+            yield event
+        return
+    token = _active.set(cassette)
+    try:
+        async for event in events:
+            yield event
+    finally:
+        try:
+            _active.reset(token)
+        except ValueError:
+            pass
+        await cassette.finish()
+
+async def recorded(kind: str, name: str, request: Any, call: Callable[[], Awaitable[Any]], **codec) -> Any:
+    """Awaits `call()` through the active cassette, if any. `codec` may hold encode/decode functions."""
+    cassette = _active.get()
+    if cassette is None:
+        return await call()
+    return await cassette.exchange(kind, name, request, call, **codec)
+
+async def recorded_stream(kind: str, name: str, request: Any, call: Callable[[], AsyncIterator[Any]], **codec) -> AsyncIterator[Any]:
+    """Iterates `call()` through the active cassette, if any."""
+    cassette = _active.get()
+    stream = call() if cassette is None else cassette.stream(kind, name, request, call, **codec)
+    async for item in stream:
+        yield item
@@ -0,0 +1,151 @@
+import asyncio
+from typing import Any, AsyncIterator, Dict, List, Optional
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import BaseMessage, message_to_dict, messages_from_dict
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.tools import BaseTool, StructuredTool, Tool
+from .cassette import CassetteMiss, active_cassette, recorded, recorded_stream
+
+# Message fields that differ between otherwise identical calls (run ids, response metadata)
+_UNSTABLE_FIELDS = ("id", "response_metadata", "usage_metadata")
+
+def _message_key(message: BaseMessage) -> Dict[str, Any]:
+    data = message_to_dict(message)
+    data["data"] = {k: v for k, v in data["data"].items() if k not in _UNSTABLE_FIELDS}
+    return data
+
+def _llm_request(messages: List[BaseMessage], stop: Optional[List[str]], kwargs: Dict[str, Any]) -> Dict[str, Any]:
+    return {"messages": [_message_key(m) for m in messages], "stop": stop, "kwargs": kwargs}
+
+def _encode_result(result: ChatResult) -> Dict[str, Any]:
+    return {
+        "generations": [{"message": message_to_dict(g.message), "info": g.generation_info} for g in result.generations],
+        "llm_output": result.llm_output,
+    }
+
+def _decode_result(data: Dict[str, Any]) -> ChatResult:
+    generations = [
+        ChatGeneration(message=messages_from_dict([g["message"]])[0], generation_info=g["info"])
+        for g in data["generations"]
+    ]
+    return ChatResult(generations=generations, llm_output=data["llm_output"])
+
+def _encode_chunk(chunk: ChatGenerationChunk) -> Dict[str, Any]:
+    return {"message": message_to_dict(chunk.message), "info": chunk.generation_info}
+
+def _decode_chunk(data: Dict[str, Any]) -> ChatGenerationChunk:
+    return ChatGenerationChunk(message=messages_from_dict([data["message"]])[0], generation_info=data["info"])
+
+class CassetteChatModel(BaseChatModel):
+    """
+    Chat model that routes the calls of `inner` through the active cassette.
+    Without an active cassette it behaves exactly like `inner`.
+    """
+
+    inner: BaseChatModel
+    name_in_cassette: str = "chat"
+
+    @property
+    def _llm_type(self) -> str:
+        return self.inner._llm_type
+
+    @property
+    def _identifying_params(self) -> Dict[str, Any]:
+        return self.inner._identifying_params
+
+    def bind_tools(self, tools, **kwargs):
+        # Let the inner model format the tools, then bind the result to this wrapper
+        return self.bind(**self.inner.bind_tools(tools, **kwargs).kwargs)
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs) -> ChatResult:
+        # The app only makes async calls; sync calls are passed through unrecorded
+        return self.inner._generate(messages, stop=stop, run_manager=run_manager, **kwargs)
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager: Optional[AsyncCallbackManagerForLLMRun] = None, **kwargs) -> ChatResult:
+        return await recorded(
+            "llm", self.name_in_cassette, _llm_request(messages, stop, kwargs),
+            lambda: self.inner._agenerate(messages, stop=stop, run_manager=run_manager, **kwargs),
+            encode=_encode_result, decode=_decode_result,
+        )
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager: Optional[AsyncCallbackManagerForLLMRun] = None, **kwargs) -> AsyncIterator[ChatGenerationChunk]:
+        cassette = active_cassette()
+        replaying = cassette is not None and cassette.replaying
+        stream = recorded_stream(
+            "llm", f"{self.name_in_cassette}.stream", _llm_request(messages, stop, kwargs),
+            lambda: self.inner._astream(messages, stop=stop, run_manager=run_manager, **kwargs),
+            encode=_encode_chunk, decode=_decode_chunk,
+        )
+        async for chunk in stream:
+            if replaying and run_manager is not None:
+                # The inner model reports tokens itself when it is called with a run manager
+                await run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+
+def wrap_chat_model(llm: BaseChatModel) -> BaseChatModel:
+    return CassetteChatModel(inner=llm)
+
+def _encode_tool_output(output: Any) -> Any:
+    # MCP tools return (content, artifacts); artifacts are kept only as far as they are JSON
+    if isinstance(output, tuple):
+        content, artifacts = output
+        if artifacts is not None:
+            artifacts = [a.model_dump(mode="json") if hasattr(a, "model_dump") else str(a) for a in artifacts]
+        return {"content": content, "artifacts": artifacts}
+    return {"content": output}
+
+def _decode_tool_output(data: Dict[str, Any]) -> Any:
+    return (data["content"], data["artifacts"]) if "artifacts" in data else data["content"]
+
+def tool_spec(tool: BaseTool) -> Dict[str, Any]:
+    """Name, description and arguments of a tool, for rebuilding it on replay."""
+    schema = tool.args_schema
+    if schema is not None and not isinstance(schema, dict):
+        schema = schema.model_json_schema()
+    return {
+        "name": tool.name,
+        "description": tool.description,
+        "args_schema": schema,
+        "single_input": isinstance(tool, Tool),
+        "response_format": tool.response_format,
+        "kind": (tool.metadata or {}).get("cassette_kind", "tool"),
+    }
+
+def _cassette_tool(spec: Dict[str, Any], call, sync_func=None) -> BaseTool:
+    """A tool with the given spec whose calls go through the active cassette."""
+    kind, name = spec["kind"], spec["name"]
+    codec = {"encode": _encode_tool_output, "decode": _decode_tool_output}
+    metadata = {"cassette_kind": kind}
+    if spec["single_input"]:
+        async def call_single(tool_input: str):
+            return await recorded(kind, name, {"input": tool_input}, lambda: call(tool_input), **codec)
+        return Tool(name=name, description=spec["description"], func=sync_func, coroutine=call_single, metadata=metadata)
+
+    async def call_structured(**arguments):
+        return await recorded(kind, name, arguments, lambda: call(**arguments), **codec)
+    return StructuredTool(
+        name=name, description=spec["description"], args_schema=spec["args_schema"],
+        coroutine=call_structured, response_format=spec["response_format"], metadata=metadata,
+    )
+
+def wrap_tool(tool: BaseTool, kind: str) -> BaseTool:
+    """
+    Wraps a Tool or StructuredTool so its calls are recorded and replayed; `kind` is
+    "mcp" or "search". The wrapped function is called directly, so the tool run
+    is reported to callbacks once, by the wrapper.
+    """
+    spec = {**tool_spec(tool), "kind": kind}
+    if isinstance(tool, Tool):
+        if tool.coroutine is not None:
+            return _cassette_tool(spec, tool.coroutine, tool.func)
+        return _cassette_tool(spec, lambda tool_input: asyncio.to_thread(tool.func, tool_input), tool.func)
+    return _cassette_tool(spec, tool.coroutine)
+
+def tools_from_specs(specs: List[Dict[str, Any]]) -> List[BaseTool]:
+    """Stand-in tools for a replay; calling one that was not recorded raises CassetteMiss."""
+    def not_recorded(name: str):
+        async def call(*args, **kwargs):
+            raise CassetteMiss(f"Tool '{name}' was not called while recording")
+        return call
+    return [_cassette_tool(spec, not_recorded(spec["name"])) for spec in specs]
@@ -2,6 +2,7 @@ from langgraph.graph import StateGraph, END
 from langchain_core.language_models import BaseChatModel # Import BaseChatModel type hint
 from .agent_state import AgentState
 from .nodes import plan_node, execute_task_node, generate_final_result_node, handle_error_node, should_continue
+from .tracing import traced
 
 def build_graph(llm: BaseChatModel):
     """
@@ -16,11 +17,11 @@ def build_graph(llm: BaseChatModel):
     # Create the workflow graph
     workflow = StateGraph(AgentState)
 
-    # Add nodes
-    workflow.add_node("planner", plan_node)
-    workflow.add_node("execute_task", execute_task_node)
-    workflow.add_node("generate_final_result", generate_final_result_node)
-    workflow.add_node("handle_error", handle_error_node)
+    # Add nodes, each recorded as a span of the request trace
+    workflow.add_node("planner", traced("node.planner", "node")(plan_node))
+    workflow.add_node("execute_task", traced("node.execute_task", "node")(execute_task_node))
+    workflow.add_node("generate_final_result", traced("node.generate_final_result", "node")(generate_final_result_node))
+    workflow.add_node("handle_error", traced("node.handle_error", "node")(handle_error_node))
 
     # Set entry point
     workflow.set_entry_point("planner")
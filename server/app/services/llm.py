@@ -0,0 +1,38 @@
+from collections import OrderedDict
+from typing import Any, Optional, Tuple
+from .cassette import CASSETTE_MODE
+
+DEFAULT_MODEL = "models/gemini-2.5-flash"
+# Default temperature of /query and /query/stream
+DEFAULT_TEMPERATURE = 0.7
+
+# Shared chat model instances, keyed by (model, temperature). Both come from the request,
+# so only the most recently used configurations are kept
+MAX_CACHED_MODELS = 8
+_chat_models: "OrderedDict[Tuple[str, Optional[float]], Any]" = OrderedDict()
+
+def get_chat_model(model: str = DEFAULT_MODEL, temperature: Optional[float] = DEFAULT_TEMPERATURE):
+    """
+    Returns a shared Gemini chat model for the given model name and temperature.
+
+    The Google client (and its gRPC channel) is created once per configuration and
+    reused across requests. langchain_google_genai is imported lazily so that
+    importing the app does not pay for it. When cassettes are on, the model is
+    wrapped so its calls are recorded or replayed.
+    """
+    key = (model, temperature)
+    llm = _chat_models.get(key)
+    if llm is not None:
+        _chat_models.move_to_end(key)
+    else:
+        from langchain_google_genai import ChatGoogleGenerativeAI
+
+        llm = ChatGoogleGenerativeAI(model=model, temperature=temperature)
+        if CASSETTE_MODE != "off":
+            from .cassette_models import wrap_chat_model
+
+            llm = wrap_chat_model(llm)
+        _chat_models[key] = llm
+        while len(_chat_models) > MAX_CACHED_MODELS:
+            _chat_models.popitem(last=False)
+    return llm
@@ -0,0 +1,258 @@
+import os
+import time
+import random
+import asyncio
+from collections import deque
+from dataclasses import dataclass, field, asdict
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional, TypeVar
+from .tracing import span, annotate, record_span
+
+T = TypeVar("T")
+
+@dataclass(frozen=True)
+class CallPolicy:
+    """How a named LLM call is bounded, retried and hedged."""
+    deadline: float = float(os.getenv("LLM_DEADLINE_SECONDS", "60"))  # Whole call, retries included
+    attempt_timeout: Optional[float] = None  # Single attempt; for streams, the wait for each chunk
+    max_retries: int = int(os.getenv("LLM_MAX_RETRIES", "2"))
+    backoff_base: float = 0.5
+    backoff_max: float = 8.0
+    hedge: bool = False  # Only for idempotent calls
+    hedge_percentile: float = float(os.getenv("LLM_HEDGE_PERCENTILE", "95"))
+    hedge_min_samples: int = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+
+# Policies per call site. Tool-calling agent runs have side effects, so they are never retried or hedged.
+POLICIES: Dict[str, CallPolicy] = {
+    "plan": CallPolicy(hedge=True),
+    "query": CallPolicy(hedge=True),
+    "query_stream": CallPolicy(attempt_timeout=30.0),
+    "execute_task": CallPolicy(deadline=180.0, max_retries=0),
+    "execute_task_llm": CallPolicy(hedge=True),
+    "final_result": CallPolicy(deadline=90.0),
+}
+
+# After a call is throttled (429), its duplicates would only add to the load, so hedging pauses this long
+THROTTLE_HOLD_SECONDS = float(os.getenv("LLM_THROTTLE_HOLD_SECONDS", "60"))
+
+def get_policy(name: str) -> CallPolicy:
+    return POLICIES.get(name) or CallPolicy()
+
+@dataclass
+class CallStats:
+    calls: int = 0
+    errors: int = 0
+    timeouts: int = 0
+    retries: int = 0
+    hedges_fired: int = 0
+    hedges_won: int = 0
+    throttled: int = 0
+    throttled_until: float = 0.0  # perf_counter() time until which hedging is paused
+    latencies: deque = field(default_factory=lambda: deque(maxlen=500))
+
+    def percentile(self, p: float) -> Optional[float]:
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        index = min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))
+        return ordered[index]
+
+_stats: Dict[str, CallStats] = {}
+
+def _get_stats(name: str) -> CallStats:
+    stats = _stats.get(name)
+    if stats is None:
+        stats = _stats[name] = CallStats()
+    return stats
+
+def llm_call_stats() -> Dict[str, Dict[str, Any]]:
+    """Counters and latency percentiles (in ms) for every named call."""
+    report = {}
+    for name, stats in _stats.items():
+        entry = {key: value for key, value in asdict(stats).items() if key not in ("latencies", "throttled_until")}
+        for p in (50, 95, 99):
+            value = stats.percentile(p)
+            entry[f"p{p}_ms"] = round(value * 1000, 1) if value is not None else None
+        report[name] = entry
+    return report
+
+def _is_throttled(error: BaseException) -> bool:
+    try:
+        from google.api_core.exceptions import ResourceExhausted
+    except ImportError:
+        return False
+    return isinstance(error, ResourceExhausted)
+
+def _note_error(error: BaseException, stats: CallStats):
+    if _is_throttled(error):
+        stats.throttled += 1
+        stats.throttled_until = time.perf_counter() + THROTTLE_HOLD_SECONDS
+
+def _is_retryable(error: BaseException) -> bool:
+    if isinstance(error, (ValueError, TypeError, KeyError)):
+        return False
+    # The Gemini client already retries 429s with its own backoff; retrying again only adds load
+    if _is_throttled(error):
+        return False
+    try:
+        from langchain_google_genai.chat_models import ChatGoogleGenerativeAIError
+    except ImportError:
+        return True
+    # Raised for invalid arguments, which fail the same way every time
+    return not isinstance(error, ChatGoogleGenerativeAIError)
+
+def _backoff(policy: CallPolicy, retry: int) -> float:
+    """Exponential backoff with full jitter."""
+    return random.uniform(0, min(policy.backoff_max, policy.backoff_base * 2 ** (retry - 1)))
+
+def _hedge_delay(policy: CallPolicy, stats: CallStats) -> Optional[float]:
+    if not policy.hedge or len(stats.latencies) < policy.hedge_min_samples:
+        return None
+    if time.perf_counter() < stats.throttled_until:
+        return None
+    return stats.percentile(policy.hedge_percentile)
+
+async def _hedged_attempt(factory: Callable[[], Awaitable[T]], delay: float, stats: CallStats) -> T:
+    """Run the call and, if it is still pending after `delay`, race a duplicate against it."""
+    primary = asyncio.ensure_future(factory())
+    tasks = {primary}
+    hedge = None
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        if done:
+            return primary.result()
+
+        stats.hedges_fired += 1
+        annotate(hedged=True)
+        hedge = asyncio.ensure_future(factory())
+        tasks.add(hedge)
+        error = None
+        while tasks:
+            done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if task is hedge:
+                        stats.hedges_won += 1
+                        annotate(hedge_won=True)
+                    return task.result()
+                error = task.exception()
+                _note_error(error, stats)
+        raise error
+    finally:
+        for task in (primary, hedge):
+            if task is not None and not task.done():
+                task.cancel()
+
+async def call_llm(
+    name: str,
+    factory: Callable[[], Awaitable[T]],
+    policy: Optional[CallPolicy] = None,
+    span_name: Optional[str] = None,
+    span_kind: str = "llm",
+) -> T:
+    """
+    Awaits an LLM call under the policy registered for `name`.
+
+    `factory` must start a new request each time it is called, e.g.
+    `lambda: llm.ainvoke(messages)`; it is called again for retries and hedges.
+    Raises TimeoutError once the policy deadline has passed. The call is traced as
+    `llm.<name>` unless `span_name` and `span_kind` say otherwise, e.g. for an agent
+    run whose own model calls are traced separately.
+    """
+    policy = policy or get_policy(name)
+    stats = _get_stats(name)
+    stats.calls += 1
+    started = time.perf_counter()
+    retry = 0
+    try:
+        with span(span_name or f"llm.{name}", span_kind) as call_span:
+            async with asyncio.timeout(policy.deadline):
+                while True:
+                    try:
+                        delay = _hedge_delay(policy, stats)
+                        if delay is not None:
+                            attempt = _hedged_attempt(factory, delay, stats)
+                        else:
+                            attempt = factory()
+                        result = await asyncio.wait_for(attempt, policy.attempt_timeout)
+                        stats.latencies.append(time.perf_counter() - started)
+                        return result
+                    except Exception as e:
+                        _note_error(e, stats)
+                        if retry >= policy.max_retries or not _is_retryable(e):
+                            raise
+                        retry += 1
+                        stats.retries += 1
+                        call_span.attributes["retries"] = retry
+                        await asyncio.sleep(_backoff(policy, retry))
+    except TimeoutError:
+        stats.timeouts += 1
+        stats.errors += 1
+        raise
+    except Exception:
+        stats.errors += 1
+        raise
+
+async def stream_llm(name: str, factory: Callable[[], AsyncIterator[T]], policy: Optional[CallPolicy] = None) -> AsyncIterator[T]:
+    """
+    Iterates an LLM stream under the policy registered for `name`.
+
+    The stream is retried with backoff only until its first chunk arrives, since
+    chunks already yielded cannot be taken back. Every chunk must arrive within
+    `attempt_timeout`; the first one also within the policy deadline.
+    The span is recorded when the stream ends, since a generator cannot hold the
+    current span across yields without leaking it into the consumer.
+    """
+    policy = policy or get_policy(name)
+    stats = _get_stats(name)
+    stats.calls += 1
+    started = time.perf_counter()
+    started_at = time.time()
+    first_chunk_ms = None
+    error = None
+    first_chunk_deadline = started + policy.deadline
+    retry = 0
+    stream = None
+    try:
+        while True:
+            stream = factory().__aiter__()
+            try:
+                timeout = first_chunk_deadline - time.perf_counter()
+                if policy.attempt_timeout is not None:
+                    timeout = min(timeout, policy.attempt_timeout)
+                first = await asyncio.wait_for(anext(stream), max(timeout, 0))
+                break
+            except StopAsyncIteration:
+                return
+            except Exception as e:
+                await stream.aclose()
+                _note_error(e, stats)
+                retryable = isinstance(e, TimeoutError) or _is_retryable(e)
+                delay = _backoff(policy, retry + 1)
+                if retry >= policy.max_retries or not retryable or time.perf_counter() + delay >= first_chunk_deadline:
+                    raise
+                retry += 1
+                stats.retries += 1
+                await asyncio.sleep(delay)
+
+        stats.latencies.append(time.perf_counter() - started)
+        first_chunk_ms = round((time.perf_counter() - started) * 1000, 1)
+        yield first
+        while True:
+            try:
+                chunk = await asyncio.wait_for(anext(stream), policy.attempt_timeout)
+            except StopAsyncIteration:
+                return
+            yield chunk
+    except TimeoutError as e:
+        stats.timeouts += 1
+        stats.errors += 1
+        error = str(e) or "TimeoutError"
+        raise
+    except Exception as e:
+        stats.errors += 1
+        error = str(e) or type(e).__name__
+        raise
+    finally:
+        if stream is not None:
+            await stream.aclose()
+        record_span(f"llm.{name}", "llm", started_at, time.time(), error=error, retries=retry, first_chunk_ms=first_chunk_ms)
@@ -1,54 +1,72 @@
+import time
+from dataclasses import replace
 from langchain_core.messages import SystemMessage, HumanMessage
-from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain.agents import create_tool_calling_agent, AgentExecutor
+from langgraph.config import get_stream_writer
 from ..agent_state import AgentState
-from .utils import get_llm
+from ..agent_cache import get_agent_executor
+from ..llm_calls import call_llm, get_policy
+from ..progress import ProgressEmitter
+from ..budget import add_usage, record_subtask_cost, subtask_deadline, usage_tokens
+from ..tracing import get_logger
+from ..tools import is_session_error, reset_mcp_client
+from .utils import get_llm, get_run_tools
+
+logger = get_logger(__name__)
+
+def _charge_subtask(state: AgentState, started: float, tokens: int):
+    """Add a finished subtask to the request budget and to the running cost estimates."""
+    record_subtask_cost(time.perf_counter() - started, tokens)
+    return add_usage(state.get("budget"), tokens=tokens, subtasks=1)
+
+def _subtask_policy(state: AgentState, name: str):
+    """The call policy for `name`, with its deadline cut to what is left of the request budget."""
+    policy = get_policy(name)
+    return replace(policy, deadline=subtask_deadline(state.get("budget"), policy.deadline))
 
 async def execute_task_node(state: AgentState) -> AgentState:
     """
     Executes the current task using the LLM or appropriate MCP tools.
-    Updates results and increments the task index.
+    Returns the task's result (added to results by the reducer) and the next task index.
     """
     _llm = get_llm()
     if _llm is None:
-         return {**state, "current_task_index": state["current_task_index"] + 1}
+         return {"current_task_index": state["current_task_index"] + 1}
 
     if state["plan"] is None or state["current_task_index"] >= len(state["plan"]):
         # Skip this task and move to next step
-         return {**state, "current_task_index": state["current_task_index"] + 1}
+         return {"current_task_index": state["current_task_index"] + 1}
 
 
     current_task_description = state["plan"][state["current_task_index"]]
     task_result = ""
+    started = time.perf_counter()
+    tokens = 0
+    progress = None
 
     try:
-        tools = state.get("tools", [])
+        tools = get_run_tools()
         if tools:
-            
-            # Create a tool-calling agent with the MCP tools
-            prompt = ChatPromptTemplate.from_messages([
-                ("system", "You are an AI assistant tasked with executing the following subtask by using available tools: {task}. \
-                 you can use the tools to answer the user's request. \
-                 available tools: {tool_names} \
-                 available data: {data}"),
-                ("human", "{input}"),
-                MessagesPlaceholder(variable_name="agent_scratchpad"),
-            ])
-            
-            agent = create_tool_calling_agent(_llm, tools, prompt)
-            agent_executor = AgentExecutor(agent=agent, tools=tools, return_intermediate_steps=True, verbose=True) 
-            
-            # Get tool names for the prompt
-            tool_names = [tool.name for tool in tools]
+            # Reuse the bound tool-calling agent and executor for this model and tool set
+            agent_executor, tool_names = get_agent_executor(_llm, tools)
 
             # Execute the agent
-            agent_response = await agent_executor.ainvoke({
+            agent_inputs = {
                 "input": current_task_description,
                 "task": state["task"],
-                "tool_names": ", ".join(tool_names),
+                "tool_names": tool_names,
                 "data": state.get("results", {}),
-                    
-            })
+            }
+            # Stream executor events so tool calls and partial output reach the client during the subtask
+            progress = ProgressEmitter(get_stream_writer(), state["current_task_index"], current_task_description)
+            agent_response = await call_llm(
+                "execute_task",
+                lambda: progress.run_executor(agent_executor, agent_inputs),
+                policy=_subtask_policy(state, "execute_task"),
+                # The agent's model turns and tool calls get their own spans
+                span_name="agent.execute_task",
+                span_kind="internal",
+            )
+            tokens = progress.tokens
             
             task_result = f"Agent execution result: {agent_response.get('output', 'No output')}"
             
@@ -58,30 +76,28 @@ async def execute_task_node(state: AgentState) -> AgentState:
                 SystemMessage(content=f"You are an AI assistant tasked with executing the following task: {current_task_description}. Please respond with the result of executing this task."),
                 HumanMessage(content=current_task_description)
             ]
-            response = _llm.invoke(messages)
+            response = await call_llm("execute_task_llm", lambda: _llm.ainvoke(messages), policy=_subtask_policy(state, "execute_task_llm"))
             task_result = response.content
-
-        # Update results with the current task's result
-        new_results = {**state.get("results", {}), current_task_description: task_result}
-        
+            tokens = usage_tokens(response)
 
         # Increment the task index for the next task
         new_task_index = state["current_task_index"] + 1
         
         return {
-            **state,
-            "results": new_results,
-            "current_task_index": new_task_index
+            "results": {current_task_description: task_result},
+            "current_task_index": new_task_index,
+            "budget": _charge_subtask(state, started, tokens)
         }
     except Exception as e:
         # Log the error for debugging
-        print(f"Error executing task '{current_task_description}': {e}")
-        import traceback
-        traceback.print_exc() # Print full traceback
+        logger.exception("Error executing task '%s': %s", current_task_description, e)
+        if is_session_error(e):
+            # The MCP session is gone; the next request reconnects
+            await reset_mcp_client(f"{type(e).__name__} during '{current_task_description}'")
 
         # Increment the task index to skip this task on error
         new_task_index = state["current_task_index"] + 1
         return {
-            **state,
             "current_task_index": new_task_index,
+            "budget": _charge_subtask(state, started, progress.tokens if progress else tokens)
         }
\ No newline at end of file
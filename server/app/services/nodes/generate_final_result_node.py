@@ -1,14 +1,16 @@
 from langchain_core.messages import SystemMessage, HumanMessage
 from ..agent_state import AgentState
+from ..llm_calls import call_llm
+from ..budget import add_usage, usage_tokens
 from .utils import get_llm
 
-def generate_final_result_node(state: AgentState) -> AgentState:
+async def generate_final_result_node(state: AgentState) -> AgentState:
     """
     Generates the final result/response to the original task based on all the gathered data.
     """
     _llm = get_llm()
     if _llm is None:
-        return {**state, "final_result": "Result not available."}
+        return {"final_result": "Result not available."}
 
     # Constructing the prompt for the LLM
     # We'll provide the original task, the plan, the results of each sub-task.
@@ -42,8 +44,8 @@ Final Response:
     ]
 
     try:
-        response = _llm.invoke(messages)
+        response = await call_llm("final_result", lambda: _llm.ainvoke(messages))
         final_result_text = response.content
-        return {**state, "final_result": final_result_text}
+        return {"final_result": final_result_text, "budget": add_usage(state.get("budget"), tokens=usage_tokens(response))}
     except Exception as e:
-        return {**state, "final_result": "Result not available."} 
\ No newline at end of file
+        return {"final_result": "Result not available."} 
\ No newline at end of file
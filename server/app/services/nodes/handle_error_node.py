@@ -8,4 +8,4 @@ def handle_error_node(state: AgentState) -> AgentState:
     new_task_index = state.get("current_task_index", 0) + 1
     
     # Return state without the error, ready to continue
-    return {**state, "current_task_index": new_task_index, "error": None} 
\ No newline at end of file
+    return {"current_task_index": new_task_index, "error": None} 
\ No newline at end of file
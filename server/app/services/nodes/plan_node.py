@@ -1,20 +1,32 @@
 from langchain_core.messages import SystemMessage, HumanMessage
 from ..agent_state import AgentState
-from .utils import get_llm
+from ..llm_calls import call_llm
+from ..budget import max_plan_steps, refine_plan, add_usage, usage_tokens
+from .utils import get_llm, get_run_tools
 
-def plan_node(state: AgentState) -> AgentState:
+def _with_plan(state: AgentState, subtasks, tokens: int = 0) -> AgentState:
+    budget = add_usage(state.get("budget"), tokens=tokens)
+    if budget:
+        budget["planned_subtasks"] = len(subtasks)
+    return {"plan": subtasks, "current_task_index": 0, "budget": budget}
+
+async def plan_node(state: AgentState) -> AgentState:
     """
     Analyzes the high-level task and breaks it down into subtasks using the LLM.
-    Stores the plan in the state.
+    The plan is kept within the request budget: trivial steps are merged,
+    presentation-only steps are dropped and the step count is capped.
+    Returns the plan and the updated budget.
     """
     _llm = get_llm()
     if _llm is None:
         # Create a fallback plan
         subtasks = [f"Execute the task: {state['task']}"]
-        return {**state, "plan": subtasks, "current_task_index": 0, "results": {}}
+        return _with_plan(state, subtasks)
     
-    # Get tools from the state
-    tools = state.get("tools", [])
+    max_steps = max_plan_steps(state.get("budget"))
+
+    # Get the tools passed to this run
+    tools = get_run_tools()
     tool_descriptions = "\n".join([f"- {tool.name}: {tool.description}" for tool in tools]) if tools else "No tools available."
 
     prompt = f'''You are a planning assistant.
@@ -28,6 +40,7 @@ you can only use the google_search tool once in the entire plan.
 
 Break down the high-level task into a series of clear, executable subtasks, considering the capabilities of the available tools. 
 If a subtask requires a tool, make sure to include that in the plan description.
+Use at most {max_steps} subtasks. Combine small related steps into one, and do not add a step for summarizing or presenting the final answer.
 
 Respond with a list of subtasks, one per line, prefixed with a hyphen.
 '''
@@ -35,15 +48,15 @@ Respond with a list of subtasks, one per line, prefixed with a hyphen.
     messages = [SystemMessage(content=prompt), HumanMessage(content=state['task'])]
 
     try:
-        response = _llm.invoke(messages)
+        response = await call_llm("plan", lambda: _llm.ainvoke(messages))
         # Assuming the LLM returns a string with tasks separated by newlines and hyphens
         subtasks = [s.strip().lstrip('-').strip() for s in response.content.strip().split('\n') if s.strip() and s.strip().startswith('-')]
         if not subtasks:
              # Fallback if LLM doesn't format as expected
              subtasks = [f"Execute the task: {state['task']}"]
 
-        return {**state, "plan": subtasks, "current_task_index": 0, "results": {}}
+        return _with_plan(state, refine_plan(subtasks, max_steps), usage_tokens(response))
     except Exception as e:
         # If planning fails, create a simple default plan
         subtasks = [f"Execute the task: {state['task']}"]
-        return {**state, "plan": subtasks, "current_task_index": 0, "results": {}} 
\ No newline at end of file
+        return _with_plan(state, subtasks) 
\ No newline at end of file
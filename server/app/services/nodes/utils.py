@@ -1,5 +1,9 @@
+from typing import List
 from langchain_core.language_models import BaseChatModel
+from langchain_core.tools import BaseTool
+from langgraph.config import get_config
 from ..agent_state import AgentState
+from ..budget import is_spent
 
 # Global variable for LLM (initialized by main)
 _llm: BaseChatModel | None = None
@@ -14,8 +18,11 @@ def should_continue(state: AgentState) -> str:
     Determines the next step based on the current state.
     Returns: "execute_task" or "generate_final_result" to trigger the appropriate node.
     """
-    # If we have a plan and current index is within plan bounds, continue execution
+    # If we have a plan and current index is within plan bounds, continue execution,
+    # unless the request budget is spent
     if state.get("plan") and state.get("current_task_index", 0) < len(state["plan"]):
+        if is_spent(state.get("budget")):
+            return "generate_final_result"
         return "execute_task"
 
     # Otherwise, we've finished the plan and should generate_final_result
@@ -23,4 +30,9 @@ def should_continue(state: AgentState) -> str:
 
 def get_llm():
     """Get the LLM instance."""
-    return _llm 
\ No newline at end of file
+    return _llm
+
+def get_run_tools() -> List[BaseTool]:
+    """Tools for the current graph run, passed in config["configurable"]["tools"]."""
+    return get_config().get("configurable", {}).get("tools") or []
+ 
\ No newline at end of file
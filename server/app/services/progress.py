@@ -0,0 +1,158 @@
+import os
+import time
+import asyncio
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from .budget import usage_tokens
+from .tracing import record_span
+
+# Progress events (tool calls and partial LLM output) are sent at most once per interval
+MIN_INTERVAL_MS = float(os.getenv("PROGRESS_MIN_INTERVAL_MS", "250"))
+# Tool events beyond this many per subtask are dropped
+MAX_TOOL_EVENTS = int(os.getenv("PROGRESS_MAX_TOOL_EVENTS", "100"))
+# Tool inputs and outputs are truncated to this many characters
+PREVIEW_CHARS = 300
+
+def _preview(value: Any) -> str:
+    text = value if isinstance(value, str) else str(value)
+    return text if len(text) <= PREVIEW_CHARS else text[:PREVIEW_CHARS] + "..."
+
+def _chunk_text(content: Any) -> str:
+    """Text of a chat model chunk; Gemini may return a list of parts instead of a string."""
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        return "".join(part if isinstance(part, str) else part.get("text", "") for part in content if isinstance(part, (str, dict)))
+    return ""
+
+class ProgressEmitter:
+    """
+    Turns agent executor events for one subtask into rate-limited progress events.
+
+    Events are passed to `write` as dicts with a "type" of "tool_start", "tool_end"
+    or "llm_output"; the /mcp route sends each type as its own SSE event. At most one
+    event is written per MIN_INTERVAL_MS: events arriving sooner are held back and
+    then written together as a "batch" event with an "events" list, in order.
+    Consecutive partial LLM output is merged into one "llm_output" event.
+    """
+
+    def __init__(self, write: Callable[[Dict[str, Any]], None], step: int, subtask: str):
+        self.write = write
+        self.step = step
+        self.subtask = subtask
+        self.tool_events = 0
+        self.tokens = 0  # Tokens reported by the model calls seen so far
+        self._tool_started: Dict[str, Tuple[str, float]] = {}
+        self._llm_started: Dict[str, Tuple[Optional[str], float]] = {}
+        self._pending: List[Dict[str, Any]] = []
+        self._last_sent = 0.0
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+
+    def _queue(self, event: Dict[str, Any]):
+        self._pending.append(event)
+        wait = MIN_INTERVAL_MS / 1000 - (time.perf_counter() - self._last_sent)
+        if wait <= 0:
+            self.flush()
+        elif self._flush_handle is None:
+            self._flush_handle = asyncio.get_running_loop().call_later(wait, self.flush)
+
+    def _queue_tool_event(self, event_type: str, **data):
+        if self.tool_events >= MAX_TOOL_EVENTS:
+            return
+        self.tool_events += 1
+        self._queue({"type": event_type, **data})
+
+    def tool_start(self, name: str, run_id: str, tool_input: Any):
+        self._tool_started[run_id] = (name, time.time())
+        self._queue_tool_event("tool_start", tool=name, input=_preview(tool_input))
+
+    def tool_end(self, name: str, run_id: str, output: Any, error: Optional[str] = None):
+        _, started = self._tool_started.pop(run_id, (name, None))
+        ended = time.time()
+        duration_ms = round((ended - started) * 1000, 1) if started is not None else None
+        if started is not None:
+            record_span(f"tool.{name}", "tool", started, ended, error=error, step=self.step)
+        data = {"tool": name, "duration_ms": duration_ms, "output": _preview(output)}
+        if error is not None:
+            data["error"] = error
+        self._queue_tool_event("tool_end", **data)
+
+    def end_pending_tools(self, error: str):
+        """Close tools that started but never reported an end, e.g. because they raised."""
+        for run_id, (name, _) in list(self._tool_started.items()):
+            self.tool_end(name, run_id, "", error=error)
+
+    def llm_start(self, run_id: str, model: Optional[str]):
+        self._llm_started[run_id] = (model, time.time())
+
+    def llm_end(self, run_id: str, output: Any, error: Optional[str] = None):
+        """Count the tokens of one agent turn and record its span."""
+        tokens = usage_tokens(output) if output is not None else 0
+        self.tokens += tokens
+        model, started = self._llm_started.pop(run_id, (None, None))
+        if started is not None:
+            record_span("llm.agent_turn", "llm", started, time.time(), error=error, step=self.step, model=model, tokens=tokens)
+
+    def end_pending_llm_turns(self, error: str):
+        """Close model calls that started but never reported an end."""
+        for run_id in list(self._llm_started):
+            self.llm_end(run_id, None, error=error)
+
+    def llm_output(self, content: Any):
+        text = _chunk_text(content)
+        if not text:
+            return
+        if self._pending and self._pending[-1]["type"] == "llm_output":
+            # A flush is already scheduled whenever events are pending
+            self._pending[-1]["text"] += text
+        else:
+            self._queue({"type": "llm_output", "text": text})
+
+    def flush(self):
+        """Write the events held back so far, as one event."""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if not self._pending:
+            return
+        if len(self._pending) == 1:
+            event = self._pending[0]
+            self.write({**event, "step": self.step, "subtask": self.subtask})
+        else:
+            self.write({"type": "batch", "step": self.step, "subtask": self.subtask, "events": self._pending})
+        self._pending = []
+        self._last_sent = time.perf_counter()
+
+    async def run_executor(self, agent_executor, inputs: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Runs the agent executor in event-streaming mode, emitting progress as it goes,
+        and returns the executor's final output.
+        """
+        output: Dict[str, Any] = {}
+        root_run_id = None
+        try:
+            async for event in agent_executor.astream_events(inputs, version="v2"):
+                kind = event["event"]
+                # The first event is the executor's own start; its end carries the final output
+                root_run_id = root_run_id or event["run_id"]
+                if kind == "on_tool_start":
+                    self.tool_start(event["name"], event["run_id"], event["data"].get("input"))
+                elif kind == "on_tool_end":
+                    self.tool_end(event["name"], event["run_id"], event["data"].get("output"))
+                elif kind == "on_chat_model_start":
+                    self.llm_start(event["run_id"], event.get("metadata", {}).get("ls_model_name"))
+                elif kind == "on_chat_model_stream":
+                    self.llm_output(getattr(event["data"].get("chunk"), "content", ""))
+                elif kind == "on_chat_model_end":
+                    self.llm_end(event["run_id"], event["data"].get("output"))
+                elif kind == "on_chain_end" and event["run_id"] == root_run_id:
+                    output = event["data"].get("output") or {}
+        except Exception as e:
+            # A tool or model call that raises reports no end event
+            self.end_pending_tools(str(e) or type(e).__name__)
+            self.end_pending_llm_turns(str(e) or type(e).__name__)
+            raise
+        finally:
+            self.end_pending_tools("Tool did not finish")
+            self.end_pending_llm_turns("Model call did not finish")
+            self.flush()
+        return output
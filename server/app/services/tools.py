@@ -3,12 +3,42 @@ import os
 import json
 from langchain_google_community import GoogleSearchAPIWrapper
 from langchain_core.tools import Tool
+import asyncio
+import anyio
+from .tracing import get_logger
+from . import warmup
+from .cassette import CASSETTE_MODE, active_cassette
+
+logger = get_logger(__name__)
 
 mcp_client = None
+_tools = None
+_init_lock = asyncio.Lock()
+_mcp_owner_task = None
+_mcp_stop_event = None
+
+async def _own_mcp_client(mcp_servers_config, ready: asyncio.Future, stop: asyncio.Event):
+    """
+    Keeps the MCP sessions open in a dedicated task.
+    The stdio transports must be entered and exited from the same task, so the client
+    is owned here rather than by whichever request or startup hook created it.
+    """
+    try:
+        async with MultiServerMCPClient(mcp_servers_config) as client:
+            ready.set_result(client)
+            await stop.wait()
+    except Exception as e:
+        if not ready.done():
+            ready.set_exception(e)
+        elif not stop.is_set() and asyncio.current_task() is _mcp_owner_task:
+            # The sessions ended on their own (e.g. a server process exited); reconnect on next use
+            _forget_mcp_client(f"MCP sessions closed: {e}")
 
 async def init_mcp_client():
     """Initialize the MCP client with configured servers."""
-    global mcp_client
+    global mcp_client, _mcp_owner_task, _mcp_stop_event
+    if mcp_client is not None:
+        return mcp_client
     
     # Load configuration from config.json
     config_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "../../config.json")
@@ -28,12 +58,22 @@ async def init_mcp_client():
                     mcp_servers_config["madgic-mcp"]["args"][i] = f"Authorization: Bearer {madgic_api_key}"
         
     except (FileNotFoundError, json.JSONDecodeError) as e:
-        print(f"Error loading config.json: {e}. Using default configuration.")
+        logger.error("Error loading config.json: %s. Using default configuration.", e)
     
-    # Create a new client if it doesn't exist
-    if mcp_client is None:
-        mcp_client = MultiServerMCPClient(mcp_servers_config)
-        await mcp_client.__aenter__()  # Use the async context manager
+    # Create a new client if it doesn't exist; the sessions are kept open for the app lifetime
+    async with _init_lock:
+        if mcp_client is None:
+            ready = asyncio.get_running_loop().create_future()
+            _mcp_stop_event = asyncio.Event()
+            _mcp_owner_task = asyncio.create_task(_own_mcp_client(mcp_servers_config, ready, _mcp_stop_event))
+            try:
+                mcp_client = await ready
+            except BaseException:
+                # Also reached when the caller times out or is cancelled while connecting
+                _mcp_owner_task.cancel()
+                _mcp_owner_task = None
+                _mcp_stop_event = None
+                raise
     
     return mcp_client
 
@@ -58,17 +98,73 @@ async def get_mcp_tools():
     return mcp_client.get_tools() if mcp_client else []
     
 
+def is_session_error(error: BaseException) -> bool:
+    """True for errors raised by a tool call when its MCP session or server process is gone."""
+    return isinstance(error, (anyio.ClosedResourceError, anyio.BrokenResourceError, anyio.EndOfStream))
+
+def _forget_mcp_client(reason: str):
+    """Drop the cached client and tools without closing them, so the next get_tools() reconnects."""
+    global mcp_client, _tools, _mcp_owner_task, _mcp_stop_event
+    logger.warning("Resetting MCP client: %s", reason)
+    mcp_client = None
+    _tools = None
+    _mcp_owner_task = None
+    _mcp_stop_event = None
+    warmup.mark_failed("mcp", reason)
+
+async def reset_mcp_client(reason: str):
+    """Close a broken MCP client; the next get_tools() reconnects."""
+    logger.warning("Resetting MCP client: %s", reason)
+    await cleanup_mcp_client()
+    warmup.mark_failed("mcp", reason)
+
 async def cleanup_mcp_client():
     """Clean up the MCP client resources."""
-    global mcp_client
-    if mcp_client is not None:
-        await mcp_client.__aexit__(None, None, None)
-        mcp_client = None 
+    global mcp_client, _tools, _mcp_owner_task, _mcp_stop_event
+    _tools = None
+    connected = mcp_client is not None
+    mcp_client = None
+    if _mcp_owner_task is not None:
+        _mcp_stop_event.set()
+        if not connected:
+            # Still connecting, so there is nothing to close cleanly
+            _mcp_owner_task.cancel()
+        await asyncio.gather(_mcp_owner_task, return_exceptions=True)
+        _mcp_owner_task = None
+        _mcp_stop_event = None
 
 
 async def get_tools():
-    mcp_tools = await get_mcp_tools()
-    google_search_tool = await get_google_search_tool()
-    all_tools = mcp_tools + [google_search_tool]
-    return all_tools
+    """
+    Get all agent tools. The list is built once and reused until cleanup_mcp_client is called.
+
+    When cassettes are on, tool calls go through the request's cassette; a replayed
+    request gets stand-ins for the tools that were offered while recording.
+    """
+    global _tools
+    cassette = active_cassette()
+    if cassette is not None and cassette.replaying:
+        from .cassette_models import tools_from_specs
+
+        if cassette.replay_tools is None:
+            cassette.replay_tools = tools_from_specs(cassette.tool_specs)
+        return cassette.replay_tools
+
+    if _tools is None:
+        mcp_tools = await get_mcp_tools()
+        google_search_tool = await get_google_search_tool()
+        if CASSETTE_MODE != "off":
+            from .cassette_models import wrap_tool
+
+            mcp_tools = [wrap_tool(tool, "mcp") for tool in mcp_tools]
+            google_search_tool = wrap_tool(google_search_tool, "search")
+        _tools = mcp_tools + [google_search_tool]
+        # Also covers a request reconnecting after prewarm failed or the sessions were reset
+        warmup.mark_warm("mcp")
+
+    if cassette is not None:
+        from .cassette_models import tool_spec
+
+        cassette.note_tools([tool_spec(tool) for tool in _tools])
+    return _tools
 
@@ -0,0 +1,300 @@
+import os
+import abc
+import copy
+import json
+import atexit
+import asyncio
+import functools
+import time
+import queue
+import uuid
+import logging
+import logging.handlers
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field, asdict
+from typing import Any, Dict, List, Optional
+
+# Completed spans are kept in memory for the most recent traces, for the debug endpoint
+MAX_TRACES = int(os.getenv("TRACE_MAX_TRACES", "200"))
+# Spans are also exported as JSON lines to this file when set
+TRACE_FILE = os.getenv("TRACE_FILE", "")
+
+@dataclass
+class Span:
+    name: str
+    kind: str  # request, node, llm, tool, ad or internal
+    trace_id: str
+    span_id: str = field(default_factory=lambda: uuid.uuid4().hex[:16])
+    parent_id: Optional[str] = None
+    start: float = field(default_factory=time.time)
+    end: Optional[float] = None
+    status: str = "ok"
+    error: Optional[str] = None
+    attributes: Dict[str, Any] = field(default_factory=dict)
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = asdict(self)
+        data["duration_ms"] = round((self.end - self.start) * 1000, 2) if self.end is not None else None
+        return data
+
+_current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+_traces: "OrderedDict[str, List[Dict[str, Any]]]" = OrderedDict()
+_thread_traces: "OrderedDict[str, List[str]]" = OrderedDict()
+
+class SpanExporter(abc.ABC):
+    """Receives every finished span as a dict. Runs on the logging thread, so it may block."""
+
+    @abc.abstractmethod
+    def export(self, span: Dict[str, Any]):
+        ...
+
+    def close(self):
+        pass
+
+class FileSpanExporter(SpanExporter):
+    """Appends spans to a file as JSON lines."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = None
+
+    def export(self, span: Dict[str, Any]):
+        if self._file is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            self._file = open(self.path, "a", encoding="utf-8")
+        self._file.write(json.dumps(span, default=str) + "\n")
+        self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+class _SpanExportHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.exporter: Optional[SpanExporter] = FileSpanExporter(TRACE_FILE) if TRACE_FILE else None
+        self.addFilter(lambda record: hasattr(record, "span"))
+
+    def emit(self, record: logging.LogRecord):
+        if self.exporter is not None:
+            try:
+                self.exporter.export(record.span)
+            except Exception:
+                self.handleError(record)
+
+class _JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key in ("trace_id", "span_id"):
+            if getattr(record, key, None):
+                entry[key] = getattr(record, key)
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+class _TraceContextFilter(logging.Filter):
+    """Tags records with the current trace and span on the calling thread."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        current = _current_span.get()
+        if current is not None:
+            record.trace_id = current.trace_id
+            record.span_id = current.span_id
+        return True
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Only merge the message arguments here; formatting happens on the logging thread
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+_span_handler = _SpanExportHandler()
+_listener: Optional[logging.handlers.QueueListener] = None
+
+_log_handler = logging.StreamHandler()
+_log_handler.setFormatter(_JsonFormatter())
+_log_handler.addFilter(lambda record: not hasattr(record, "span"))
+
+# All app loggers ("app.*") hand their records to a queue; a background thread formats and writes them
+_app_logger = logging.getLogger("app")
+_queue_handler = _QueueHandler(_queue)
+_queue_handler.addFilter(_TraceContextFilter())
+_app_logger.addHandler(_queue_handler)
+_app_logger.setLevel(os.getenv("LOG_LEVEL", "INFO"))
+_app_logger.propagate = False
+
+# Spans are exported whatever LOG_LEVEL is; the stream handler skips span records
+_span_logger = logging.getLogger("app.trace")
+_span_logger.setLevel(logging.DEBUG)
+
+def get_logger(name: str) -> logging.Logger:
+    """Logger whose records are written by the background logging thread."""
+    return logging.getLogger(name)
+
+def start_logging():
+    """Start the background thread that writes log records and exports spans."""
+    global _listener
+    if _listener is None:
+        _listener = logging.handlers.QueueListener(_queue, _log_handler, _span_handler, respect_handler_level=True)
+        _listener.start()
+
+def stop_logging():
+    """Flush queued records and stop the background thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+    if _span_handler.exporter is not None:
+        _span_handler.exporter.close()
+
+start_logging()
+atexit.register(stop_logging)
+
+def set_span_exporter(exporter: Optional[SpanExporter]):
+    """Replace the exporter that finished spans are sent to."""
+    _span_handler.exporter = exporter
+
+def new_trace_id() -> str:
+    return uuid.uuid4().hex
+
+def current_trace_id() -> Optional[str]:
+    current = _current_span.get()
+    return current.trace_id if current is not None else None
+
+def _finish(span: Span):
+    span.end = span.end or time.time()
+    data = span.to_dict()
+    spans = _traces.get(span.trace_id)
+    if spans is None:
+        spans = _traces[span.trace_id] = []
+        while len(_traces) > MAX_TRACES:
+            _traces.popitem(last=False)
+    spans.append(data)
+    _span_logger.info(span.name, extra={"span": data})
+
+@contextmanager
+def span(name: str, kind: str = "internal", **attributes):
+    """
+    Records a span around the enclosed block, as a child of the current span.
+    Outside of a trace the yielded span is not recorded.
+    """
+    parent = _current_span.get()
+    if parent is None:
+        yield Span(name=name, kind=kind, trace_id="", attributes=attributes)
+        return
+    current = Span(name=name, kind=kind, trace_id=parent.trace_id, parent_id=parent.span_id, attributes=attributes)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.status = "error"
+        current.error = str(e) or type(e).__name__
+        raise
+    finally:
+        try:
+            _current_span.reset(token)
+        except ValueError:
+            # Exited from another context (e.g. an async generator closed by a different task)
+            pass
+        _finish(current)
+
+@contextmanager
+def start_trace(name: str, trace_id: Optional[str] = None, thread_id: Optional[str] = None, **attributes):
+    """Records the root span of a request; spans opened inside it join its trace."""
+    root = Span(name=name, kind="request", trace_id=trace_id or new_trace_id(), attributes=attributes)
+    if thread_id:
+        root.attributes["thread_id"] = thread_id
+        trace_ids = _thread_traces.setdefault(thread_id, [])
+        trace_ids.append(root.trace_id)
+        del trace_ids[:-MAX_TRACES]
+        _thread_traces.move_to_end(thread_id)
+        while len(_thread_traces) > MAX_TRACES:
+            _thread_traces.popitem(last=False)
+    token = _current_span.set(root)
+    try:
+        yield root
+    except BaseException as e:
+        root.status = "error"
+        root.error = str(e) or type(e).__name__
+        raise
+    finally:
+        try:
+            _current_span.reset(token)
+        except ValueError:
+            pass
+        _finish(root)
+
+async def trace_stream(events, name: str, trace_id: Optional[str] = None, thread_id: Optional[str] = None, **attributes):
+    """Runs an async generator (e.g. an SSE event stream) inside a request trace."""
+    with start_trace(name, trace_id=trace_id, thread_id=thread_id, **attributes):
+        async for event in events:
+            yield event
+
+def annotate(**attributes):
+    """Adds attributes to the current span, if any."""
+    current = _current_span.get()
+    if current is not None:
+        current.attributes.update(attributes)
+
+def traced(name: str, kind: str = "internal"):
+    """Decorator that records a span around every call of a sync or async function."""
+    def decorator(fn):
+        if asyncio.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with span(name, kind):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name, kind):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def record_span(name: str, kind: str, start: float, end: float, error: Optional[str] = None, **attributes):
+    """Records a span that was timed elsewhere (e.g. from callback events) under the current span."""
+    parent = _current_span.get()
+    if parent is None:
+        return
+    _finish(Span(
+        name=name, kind=kind, trace_id=parent.trace_id, parent_id=parent.span_id,
+        start=start, end=end, status="error" if error else "ok", error=error, attributes=attributes,
+    ))
+
+def get_trace_timeline(trace_id: str) -> Optional[Dict[str, Any]]:
+    """Spans of a trace ordered by start time, with their offset from the start of the trace and depth."""
+    spans = _traces.get(trace_id)
+    if spans is None:
+        return None
+    ordered = sorted(spans, key=lambda s: s["start"])
+    by_id = {s["span_id"]: s for s in ordered}
+    trace_start = ordered[0]["start"]
+    timeline = []
+    for s in ordered:
+        depth, parent_id = 0, s["parent_id"]
+        while parent_id in by_id:
+            depth += 1
+            parent_id = by_id[parent_id]["parent_id"]
+        timeline.append({**s, "offset_ms": round((s["start"] - trace_start) * 1000, 2), "depth": depth})
+    return {"trace_id": trace_id, "spans": timeline}
+
+def get_thread_trace_ids(thread_id: str) -> List[str]:
+    """Trace ids recorded for a thread, oldest first, limited to traces still in memory."""
+    return [trace_id for trace_id in _thread_traces.get(thread_id, []) if trace_id in _traces]
@@ -0,0 +1,169 @@
+import os
+import time
+import random
+import asyncio
+from typing import Dict, Any
+from .tracing import get_logger
+
+logger = get_logger(__name__)
+
+# Duration in milliseconds of each measured startup phase, in the order they ran
+startup_phases: Dict[str, float] = {}
+
+# Warm-up state of each resource the agent depends on: "pending", "warm", "skipped" or "failed"
+resources: Dict[str, str] = {
+    "llm": "pending",
+    "mcp": "pending",
+    "graph": "pending",
+    "ad_server": "pending",
+}
+
+# Last error seen while warming each resource
+errors: Dict[str, str] = {}
+
+_startup_complete = False
+
+# Failed resources are warmed again in the background, with exponential backoff and full jitter
+RETRY_BACKOFF_BASE = 1.0
+RETRY_BACKOFF_MAX = 60.0
+_retry_task = None
+
+def prewarm_timeout() -> float:
+    """Maximum time in seconds to spend warming a single resource (PREWARM_TIMEOUT_SECONDS, default 30)."""
+    return float(os.getenv("PREWARM_TIMEOUT_SECONDS", "30"))
+
+def prewarm_enabled() -> bool:
+    """Whether resources should be warmed at startup (PREWARM_ON_STARTUP, default true)."""
+    return os.getenv("PREWARM_ON_STARTUP", "true").lower() in ("1", "true", "yes")
+
+def record_phase(name: str, started: float):
+    """Record a phase that started at the given perf_counter() value and ends now."""
+    startup_phases[name] = round((time.perf_counter() - started) * 1000, 1)
+
+def mark_startup_complete():
+    global _startup_complete
+    _startup_complete = True
+
+def is_ready() -> bool:
+    """
+    The server is ready once startup has finished and every required resource is warm.
+    When prewarming is disabled, resources are created lazily by the first request and
+    readiness only reflects that startup has finished.
+    """
+    if not _startup_complete:
+        return False
+    if not prewarm_enabled():
+        return True
+    return all(status in ("warm", "skipped") for status in resources.values())
+
+def readiness_report() -> Dict[str, Any]:
+    return {
+        "status": "ready" if is_ready() else "not_ready",
+        "prewarm": prewarm_enabled(),
+        "resources": dict(resources),
+        "errors": dict(errors),
+        "startup_phases_ms": dict(startup_phases),
+    }
+
+async def _warm_llm():
+    from google.ai.generativelanguage_v1beta.types import Content, Part
+    from .llm import get_chat_model, DEFAULT_MODEL, DEFAULT_TEMPERATURE
+    from .agent_service import AGENT_MODEL, AGENT_TEMPERATURE
+
+    # The agent's model and the /query default are separate clients, each with its own channel
+    for config in dict.fromkeys([(AGENT_MODEL, AGENT_TEMPERATURE), (DEFAULT_MODEL, DEFAULT_TEMPERATURE)]):
+        # With cassettes on, the Gemini model is wrapped; warm the model itself
+        llm = get_chat_model(*config)
+        llm = getattr(llm, "inner", llm)
+        # Requests go through the async (grpc.aio) client, so count tokens through it to open its channel
+        await llm.async_client.count_tokens(model=llm.model, contents=[Content(parts=[Part(text="ping")])])
+
+async def _warm_mcp():
+    from .tools import get_tools
+
+    await get_tools()
+
+async def _warm_graph():
+    from .agent_service import get_agent_graph
+
+    get_agent_graph()
+
+async def _warm_ad_server() -> bool:
+    from .ad_client import ad_client
+
+    return await ad_client.warmup()
+
+# Warm-up function and whether the resource is required for readiness, by resource
+_warmers = {
+    "llm": (_warm_llm, True),
+    "mcp": (_warm_mcp, True),
+    "graph": (_warm_graph, True),
+    "ad_server": (_warm_ad_server, False),
+}
+
+async def _warm(name: str):
+    warm_fn, required = _warmers[name]
+    started = time.perf_counter()
+    try:
+        result = await asyncio.wait_for(warm_fn(), timeout=prewarm_timeout())
+        resources[name] = "skipped" if result is False else "warm"
+        errors.pop(name, None)
+    except Exception as e:
+        errors[name] = str(e) or type(e).__name__
+        # Optional resources fall back at request time, so they don't hold back readiness
+        resources[name] = "failed" if required else "skipped"
+        logger.warning("Failed to prewarm %s: %s", name, errors[name])
+    finally:
+        record_phase(f"prewarm.{name}", started)
+
+def _failed() -> list:
+    return [name for name, status in resources.items() if status == "failed"]
+
+async def _retry_failed():
+    """Warm failed resources again until all of them are warm."""
+    attempt = 0
+    while _failed():
+        attempt += 1
+        await asyncio.sleep(random.uniform(0, min(RETRY_BACKOFF_MAX, RETRY_BACKOFF_BASE * 2 ** (attempt - 1))))
+        await asyncio.gather(*(_warm(name) for name in _failed()))
+    logger.info("Resources warm again after %d retries: %s", attempt, resources)
+
+def _schedule_retry():
+    global _retry_task
+    if prewarm_enabled() and _failed() and (_retry_task is None or _retry_task.done()):
+        _retry_task = asyncio.get_running_loop().create_task(_retry_failed())
+
+def mark_warm(name: str):
+    """Record that a resource was set up outside of prewarm, e.g. lazily by a request."""
+    if resources.get(name) != "warm":
+        resources[name] = "warm"
+        errors.pop(name, None)
+
+def mark_failed(name: str, error: str):
+    """Record that a resource broke after warming up; it is warmed again in the background."""
+    resources[name] = "failed"
+    errors[name] = error
+    _schedule_retry()
+
+async def prewarm():
+    """
+    Warms the Gemini client, the MCP sessions and tool list, the compiled agent graph
+    and the ad-server connection concurrently.
+    """
+    started = time.perf_counter()
+    await asyncio.gather(*(_warm(name) for name in _warmers))
+    record_phase("prewarm", started)
+    logger.info("Prewarm finished: %s (%s ms)", resources, startup_phases["prewarm"])
+    # Required resources that failed are retried in the background; /ready waits for them
+    _schedule_retry()
+
+async def shutdown():
+    """Release the resources opened by prewarm or by requests."""
+    from .tools import cleanup_mcp_client
+    from .ad_client import ad_client
+
+    if _retry_task is not None and not _retry_task.done():
+        _retry_task.cancel()
+        await asyncio.gather(_retry_task, return_exceptions=True)
+    await cleanup_mcp_client()
+    await ad_client.close()
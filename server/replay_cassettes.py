@@ -0,0 +1,92 @@
+"""
+Replays recorded cassettes against a server running with CASSETTE_MODE=replay and
+compares each request's duration with its recording.
+
+    python replay_cassettes.py --url http://localhost:8080 --latency recorded --timing original
+
+With --latency recorded the difference from the recording is time spent in our own
+code; with --latency zero the whole duration is. --timing original keeps the gaps
+between requests as they were recorded, so production traffic shapes are replayed.
+
+The replay server needs no live services, but ADSERVER_URL and MADGIC_API_KEY must
+still be set (to any value) for the recorded ad-server exchanges to be replayed.
+"""
+import os
+import sys
+import json
+import glob
+import time
+import asyncio
+import argparse
+import httpx
+
+async def replay_one(client: httpx.AsyncClient, url: str, path: str, latency: str) -> dict:
+    with open(path, encoding="utf-8") as f:
+        cassette = json.load(f)
+    headers = {"X-Cassette": os.path.basename(path), "X-Cassette-Latency": latency}
+    started = time.perf_counter()
+    first_event_ms = None
+    status = None
+    async with client.stream("POST", url + cassette["endpoint"], json=cassette["request"], headers=headers) as response:
+        status = response.status_code
+        async for line in response.aiter_lines():
+            if first_event_ms is None and line.startswith("event:"):
+                first_event_ms = (time.perf_counter() - started) * 1000
+    duration_ms = (time.perf_counter() - started) * 1000
+    return {
+        "cassette": os.path.basename(path),
+        "status": status,
+        "recorded_ms": cassette["duration_ms"],
+        "replay_ms": round(duration_ms, 1),
+        "first_event_ms": round(first_event_ms, 1) if first_event_ms is not None else None,
+        "delta_ms": round(duration_ms - cassette["duration_ms"], 1),
+    }
+
+async def main(args) -> int:
+    paths = sorted(glob.glob(os.path.join(args.dir, "*.json")))
+    if not paths:
+        print(f"No cassettes in {args.dir}")
+        return 1
+    # Requests are replayed in the order they started while recording
+    started_at = {}
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            cassette = json.load(f)
+        started_at[path] = cassette.get("started_at", cassette["recorded_at"] - cassette["duration_ms"] / 1000)
+    paths.sort(key=started_at.get)
+
+    async with httpx.AsyncClient(timeout=None) as client:
+        if args.timing == "sequential":
+            results = [await replay_one(client, args.url, path, args.latency) for path in paths]
+        else:
+            tasks = []
+            first_started = started_at[paths[0]]
+            replay_started = time.perf_counter()
+            for path in paths:
+                # Start each request at the same offset from the first one as when it was recorded
+                wait = (started_at[path] - first_started) - (time.perf_counter() - replay_started)
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                tasks.append(asyncio.create_task(replay_one(client, args.url, path, args.latency)))
+            results = await asyncio.gather(*tasks)
+
+    print(f"{'cassette':60} {'status':>6} {'recorded':>10} {'replay':>10} {'first':>8} {'delta':>9}")
+    for r in results:
+        print(f"{r['cassette'][:60]:60} {r['status']:>6} {r['recorded_ms']:>10.0f} {r['replay_ms']:>10.0f} {r['first_event_ms'] or 0:>8.0f} {r['delta_ms']:>+9.0f}")
+
+    failed = [r for r in results if r["status"] != 200 or (args.max_delta_ms is not None and r["delta_ms"] > args.max_delta_ms)]
+    if failed:
+        print(f"{len(failed)} of {len(results)} replays failed or exceeded --max-delta-ms")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay recorded cassettes and compare durations.")
+    parser.add_argument("--url", default="http://localhost:8080")
+    parser.add_argument("--dir", default=os.getenv("CASSETTE_DIR", "cassettes"))
+    parser.add_argument("--latency", choices=["recorded", "zero"], default="recorded")
+    parser.add_argument("--timing", choices=["original", "sequential"], default="sequential",
+                        help="original: keep the recorded gaps between requests; sequential: one at a time")
+    parser.add_argument("--max-delta-ms", type=float, default=None,
+                        help="fail if a replay takes this much longer than its recording")
+    sys.exit(asyncio.run(main(parser.parse_args())))